@@ -1,6 +1,49 @@
-
 import os
 import shutil
+import threading
+
+
+_local = threading.local()  # pylint: disable=C0103
+
+
+def get_base_dir():
+    """Returns the base directory of the current thread to resolve the
+    relative paths, which is the current directory if it's unset."""
+    return getattr(_local, 'base_dir', None) or os.getcwd()
+
+
+def absolute_path(path, base=None):
+    """Returns the path resolved with the base directory."""
+    path = os.path.expanduser(path)
+    if os.path.isabs(path):
+        return path
+
+    return os.path.normpath(os.path.join(base or get_base_dir(), path))
+
+
+class BaseDir(object):
+    """Sets the base directory of the current thread.
+
+    Unlike AutoChangedDir, the current directory of the process, which is
+    shared by all threads, isn't changed. So the sub-commands with their
+    own base directories could run in the threads at the same time."""
+
+    def __init__(self, newdir, create=True):
+        self.newdir = absolute_path(newdir)
+        self.create = create
+        self.olddir = None
+
+    def __enter__(self):
+        if self.create and not os.path.exists(self.newdir):
+            os.makedirs(self.newdir)
+
+        self.olddir = getattr(_local, 'base_dir', None)
+        _local.base_dir = self.newdir
+
+        return self.newdir
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.base_dir = self.olddir
 
 
 class AutoChangedDir(object):
@@ -3,7 +3,7 @@ import os
 import re
 
 from options import Values
-from topics import KrepXmlConfigFile, PatternFile, \
+from topics import FileUtils, JobTokens, KrepXmlConfigFile, PatternFile, \
     RaiseExceptionIfOptionMissed, SubCommandWithThread
 
 
@@ -258,6 +258,8 @@ The format of the plain-text configuration file can refer to the topic
                       largs,
                       ignore_except=ignore_error)
 
+            return True
+
         def _batch(batch):
             conf = BatchXmlConfigFile(batch)
 
@@ -293,10 +295,13 @@ The format of the plain-text configuration file can refer to the topic
                         'schema is not recognized or undefined in %s' %
                         project)
 
+                # run in the base directory of batch without the working
+                # directory as the current directory isn't changed
                 working_dir = project.pop('working_dir')
-                if working_dir:
-                    setattr(
-                        project, 'working_dir', os.path.abspath(working_dir))
+                setattr(
+                    project, 'working_dir',
+                    FileUtils.absolute_path(working_dir) if working_dir
+                    else FileUtils.get_base_dir())
 
                 if multiple:
                     projs.append(project)
@@ -307,9 +312,12 @@ The format of the plain-text configuration file can refer to the topic
                 return _list(batch, projs, nprojs)
 
             ret = self.run_with_thread(  # pylint: disable=E1101
-                options.job, nprojs, _run)
+                options.job, nprojs, _run, options=options)
+            # the projects with jobs run at the same time only if the jobs
+            # are limited by the budget shared with them
             ret = self.run_with_thread(  # pylint: disable=E1101
-                1, projs, _run) and ret
+                options.job if JobTokens.get() else 1, projs, _run,
+                options=options) and ret
 
             return ret
 
@@ -321,6 +329,7 @@ The format of the plain-text configuration file can refer to the topic
         files.extend(args[:])
 
         for batch in files:
+            batch = FileUtils.absolute_path(batch)
             if os.path.isfile(batch):
                 ret = _batch(batch) and ret
             else:
@@ -6,7 +6,9 @@ except ImportError:
 
 from options import Values
 from topics import FileUtils, GitProject, SubCommand, DownloadError, \
-    Gerrit, Pattern, ProcessingError, RaiseExceptionIfOptionMissed
+    EventStream, Gerrit, GerritError, GerritInventory, KrepError, \
+    MirrorState, Pattern, ProcessingError, RaiseExceptionIfOptionMissed, \
+    RemoteRefCache
 
 
 class GitCloneSubcmd(SubCommand):
@@ -26,7 +28,11 @@ repository will be requested to create with the description.
 The default description has the format "Mirror of GIT_URL". If option
 "--no-description" is used, no description will be added. The description
 could has a customized format like "Mirror of %url", which %url would be
-replaced by GIT_URL."""
+replaced by GIT_URL.
+
+With the option "--stream-events", the command keeps running after the import
+and imports the project again once a "ref-updated" event of the project is
+read from the "gerrit stream-events" of the upstream."""
 
     def options(self, optparse):
         SubCommand.options(self, optparse, option_remote=True,
@@ -75,7 +81,6 @@ replaced by GIT_URL."""
             ulp.scheme or options.remote,
             'Neither git name (--name) nor remote (--remote) is set')
 
-        logger = self.get_logger()  # pylint: disable=E1101
         if ulp.scheme:
             remote = ulp.hostname
             projectname = ulp.path.strip('/')
@@ -87,6 +92,10 @@ replaced by GIT_URL."""
             remote, prefix='git://', subdir=projectname, exists=False)
 
         working_dir = self.get_absolute_working_dir(options)  # pylint: disable=E1101
+        # the stuffs of krep are kept in the git directory
+        krep_dir = FileUtils.ensure_path(
+            working_dir, subdir=None if options.bare else '.git',
+            exists=False)
         project = GitProject(
             options.git,
             worktree=working_dir,
@@ -97,8 +106,72 @@ replaced by GIT_URL."""
             bare=options.bare,
             pattern=GitCloneSubcmd.get_patterns(options)  # pylint: disable=E1101
         )
+        project.set_ref_cache(RemoteRefCache.build(options, krep_dir))
+
+        self._download(options, project)
+        # created after downloading not to block cloning into the directory,
+        # and kept for the following events
+        state = MirrorState.build(options, krep_dir)
+        try:
+            ret = self._mirror(options, project, remote, krep_dir, state)
+            if options.stream_events and not options.offsite:
+                ret = self._follow_events(
+                    options, project, remote, krep_dir, state) or ret
+        finally:
+            if state is not None:
+                state.close()
+
+        return ret
+
+    @staticmethod
+    def _matches(url, name):
+        """Returns true if the upstream url is the project of the event."""
+        path = urlparse(url or '').path.rstrip('/')
+        if path.endswith('.git'):
+            path = path[:-4]
+
+        return path.strip('/') == name or \
+            path.endswith('/%s' % name) or path.endswith(':%s' % name)
+
+    def _follow_events(  # pylint: disable=R0913
+            self, options, project, remote, krep_dir, state):
+        """Imports the project again for its events until the stream ends,
+        returns the result of the last import."""
+        logger = self.get_logger()  # pylint: disable=E1101
+
+        # the git directory has been created by the first import
+        if not project.gitdir:
+            project.set_path(
+                gitdir=FileUtils.ensure_path(project.worktree, '.git'))
 
         ret = 0
+        for update in EventStream(options.stream_events).updates():
+            if not GitCloneSubcmd._matches(options.git, update.project) or \
+                    not update.ref.startswith(('refs/heads/', 'refs/tags/')):
+                continue
+
+            logger.info('%s updated to %s', update.ref, update.new)
+            # the existed clone with a worktree isn't fetched by download()
+            if not options.bare and \
+                    project.fetch('origin', '--tags', '--prune'):
+                logger.error('failed to fetch %s', update.ref)
+                ret = 1
+                continue
+
+            # the refs are pushed only if they're different from the
+            # snapshot of the remote
+            try:
+                self._download(options, project)
+                ret = self._mirror(options, project, remote, krep_dir, state)
+            except (KrepError, GerritError) as e:
+                # keep following for the next event
+                logger.error('failed to mirror %s: %s', update.ref, e)
+                ret = 1
+
+        return ret
+
+    @staticmethod
+    def _download(options, project):
         if not options.offsite:
             optgc = options.extra_values(options.extra_option, 'git-clone')
             ret = project.download(
@@ -107,11 +180,27 @@ replaced by GIT_URL."""
             if ret != 0:
                 raise DownloadError('%s: failed to fetch project' % project)
 
+    def _mirror(  # pylint: disable=R0913
+            self, options, project, remote, krep_dir, state):
+        logger = self.get_logger()  # pylint: disable=E1101
+
+        ret = 0
+        extras = MirrorState.extras(options, options.revision)
+        refs = None
+        if state is not None:
+            project.load_local_refs()
+            refs = project.local_refs
+            if state.unchanged(str(project), remote, refs, *extras):
+                logger.info('local refs are unchanged since the last push')
+                return ret
+
         ulp = urlparse(remote)
         # creat the project in the remote
         if ulp.scheme in ('ssh', 'git'):
             if not options.dryrun and options.remote and options.repo_create:
                 gerrit = Gerrit(options.remote, options)
+                gerrit.set_inventory(
+                    GerritInventory.build(options, krep_dir))
                 gerrit.create_project(
                     ulp.path.strip('/'),
                     description=options.description,
@@ -126,48 +215,43 @@ replaced by GIT_URL."""
 
         optgp = options.extra_values(options.extra_option, 'git-push')
 
+        heads, tags = None, None
         # push the branches
         if self.override_value(  # pylint: disable=E1101
                 options.all, options.heads):
-            optp = Values.build(
-                extra=optgp,
-                push_all=options.all or options.revision is None,
-                fullname=options.keep_name)
-
-            res = project.push_heads(
-                options.revision,
-                self.override_value(  # pylint: disable=E1101
+            heads = dict(
+                branch=options.revision,
+                refs=self.override_value(  # pylint: disable=E1101
                     options.refs, options.head_refs),
-                options.head_pattern,
-                options=optp,
-                push_all=options.all or options.revision is None,
-                fullname=options.keep_name,
-                force=options.force,
-                dryrun=options.dryrun)
-
-            ret |= res
-            if res:
-                logger.error('Failed to push heads')
+                patterns=options.head_pattern,
+                options=Values.build(
+                    extra=optgp,
+                    push_all=options.all or options.revision is None,
+                    fullname=options.keep_name),
+                force=options.force)
 
         # push the tags
         if self.override_value(  # pylint: disable=E1101
                 options.all, options.tags):
-            optp = Values.build(
-                extra=optgp,
-                fullname=options.keep_name)
-
-            res = project.push_tags(
-                None if options.all else options.tag,
-                self.override_value(  # pylint: disable=E1101
+            tags = dict(
+                tags=None if options.all else options.tag,
+                refs=self.override_value(  # pylint: disable=E1101
                     options.refs, options.tag_refs),
-                options.tag_pattern,
-                options=optp,
-                force=options.force,
-                dryrun=options.dryrun)
+                patterns=options.tag_pattern,
+                options=Values.build(
+                    extra=optgp,
+                    fullname=options.keep_name),
+                force=options.force)
+
+        if heads is not None or tags is not None:
+            res = project.push_refs(heads, tags, dryrun=options.dryrun)
 
             ret |= res
             if res:
-                logger.error('Failed to push tags')
+                logger.error('Failed to push heads and tags')
+
+        if ret == 0 and state is not None and not options.dryrun:
+            state.save(str(project), remote, refs, *extras)
 
         self.do_hook(  # pylint: disable=E1101
             'post-push', options, dryrun=options.dryrun)
@@ -15,7 +15,8 @@ except ImportError:
 
 from options import Values
 from topics import FileDiff, FileUtils, FileVersion, FileWasher, GitProject, \
-    Gerrit, key_compare, Logger, SubCommand, RaiseExceptionIfOptionMissed
+    Gerrit, GerritInventory, key_compare, Logger, MirrorState, \
+    SubCommand, RaiseExceptionIfOptionMissed
 
 
 def _handle_message_with_escape(pkg, escaped=True, default=None,
@@ -78,7 +79,8 @@ class PkgImporter(object):
         self.count = 0
         self.tags = list()
         self.timestamp = 0
-        self.tmpdir = self.options.directory or tempfile.mkdtemp()
+        self.tmpdir = FileUtils.absolute_path(
+            self.options.directory or tempfile.mkdtemp())
 
         return self
 
@@ -405,7 +407,9 @@ The escaped variants are supported for the imported files including:
                 logger and logger.error(
                     'Error: %s failed to be recognized with revision' % pkg)
             else:
-                pkgs[revision] = (os.path.realpath(pkg), pkgname, revision)
+                pkgs[revision] = (
+                    os.path.realpath(FileUtils.absolute_path(pkg)), pkgname,
+                    revision)
 
                 name = pkgname
                 rets.append(pkgs[revision])
@@ -457,8 +461,23 @@ The escaped variants are supported for the imported files including:
         RaiseExceptionIfOptionMissed(
             args, "no files or directories are specified to import")
 
-        if not options.dryrun and options.remote:
+        if options.remote:
+            ulp = urlparse(options.remote)
+            if not ulp.scheme:
+                remote = 'git://%s/%s' % (
+                    options.remote.strip('/'), options.name)
+            else:
+                remote = '%s/%s' % (options.remote.strip('/'), options.name)
+        else:
+            remote = ''
+
+        working_dir = self.get_absolute_working_dir(options)  # pylint: disable=E1101
+        state = MirrorState.build(options, working_dir)
+        # the project pushed before has been created
+        if not options.dryrun and options.remote and not (
+                state is not None and state.has(options.name, remote)):
             gerrit = Gerrit(options.remote, options)
+            gerrit.set_inventory(GerritInventory.build(options, working_dir))
             gerrit.create_project(
                 options.name,
                 description=options.description or False,
@@ -471,16 +490,6 @@ The escaped variants are supported for the imported files including:
         if options.offsite and not os.path.exists(path):
             os.makedirs(path)
 
-        if options.remote:
-            ulp = urlparse(options.remote)
-            if not ulp.scheme:
-                remote = 'git://%s/%s' % (
-                    options.remote.strip('/'), options.name)
-            else:
-                remote = '%s/%s' % (options.remote.strip('/'), options.name)
-        else:
-            remote = ''
-
         project = GitProject(
             options.name,
             worktree=path,
@@ -534,6 +543,14 @@ The escaped variants are supported for the imported files including:
             if ptags:
                 tags.extend(ptags)
 
+        extras = MirrorState.extras(options, branch, tags)
+        if not ret and not options.local and state is not None:
+            project.load_local_refs()
+            refs = project.local_refs
+            if state.unchanged(options.name, remote, refs, *extras):
+                logger.info('local refs are unchanged since the last push')
+                return True
+
         if not ret and not options.local:
             # pylint: disable=E1101
             # push the branches
@@ -554,5 +571,8 @@ The escaped variants are supported for the imported files including:
                     options=optp, force=options.force, dryrun=options.dryrun)
             # pylint: enable=E1101
 
+            if ret == 0 and state is not None and not options.dryrun:
+                state.save(options.name, remote, refs, *extras)
+
         return ret == 0
 
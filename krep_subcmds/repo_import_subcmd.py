@@ -9,9 +9,9 @@ from repo_subcmd import RepoSubcmd
 
 from options import Values
 # pylint: disable=W0611
-from topics import ConfigFile, FileVersion, GitProject, key_compare, \
-    KrepXmlConfigFile, Logger, Pattern, RaiseExceptionIfOptionMissed, \
-    SubCommandWithThread
+from topics import ConfigFile, FileUtils, FileVersion, GitProject, \
+    key_compare, KrepXmlConfigFile, Logger, Pattern, \
+    RaiseExceptionIfOptionMissed, SubCommandWithThread
 # pylint: enable=W0611
 
 
@@ -518,10 +518,10 @@ be used to define the wash-out and generate the final commit.
                     'not all items of "%s" has defined "path"',
                     project_name)
 
-                return 1
+                return False
         else:
             logger.warning('"%s" is undefined', project_name)
-            return 0
+            return True
 
         changed = False
         matcher = VersionMatcher(options.project)
@@ -546,6 +546,7 @@ be used to define the wash-out and generate the final commit.
         RepoImportSubcmd.do_hook(  # pylint: disable=E1101
             'pre-push', options, dryrun=options.dryrun)
 
+        ret = 0
         optgp = options.extra_values(options.extra_option, 'git-push')
         optp = Values.build(extra=optgp, fullname=True)
         # push the branches
@@ -560,6 +561,7 @@ be used to define the wash-out and generate the final commit.
                 logger=logger)
             if res != 0:
                 logger.error('failed to push heads')
+                ret = res
 
         # push the tags
         if changed and RepoImportSubcmd.override_value(  # pylint: disable=E1101
@@ -572,10 +574,13 @@ be used to define the wash-out and generate the final commit.
                 logger=logger)
             if res != 0:
                 logger.error('failed to push tags')
+                ret = res
 
         RepoImportSubcmd.do_hook(  # pylint: disable=E1101
             'post-push', options, dryrun=options.dryrun)
 
+        return ret == 0
+
     def execute(self, options, *args, **kws):  # pylint: disable=R0915
         SubCommandWithThread.execute(self, options, *args, **kws)
 
@@ -602,6 +607,7 @@ be used to define the wash-out and generate the final commit.
             RepoSubcmd.fetch_projects_in_manifest(options),
             RepoImportSubcmd.push, options, cfg,
             Logger.get_logger(),  # pylint: disable=E1101
-            args)
+            [FileUtils.absolute_path(arg) for arg in args],
+            options=options)
 
         return 0
@@ -1,8 +1,12 @@
 
 import os
+import threading
+import time
 
 from repo_subcmd import RepoSubcmd
-from topics import GitProject
+from topics import DownloadError, EventStream, Gerrit, GerritInventory, \
+    GitProject, MirrorState, PollSchedule, RaiseExceptionIfOptionMissed, \
+    RemoteRefCache, SubCommandWithThread
 
 
 class RepoMirrorSubcmd(RepoSubcmd):
@@ -23,14 +27,118 @@ All projects inside .repo/default.xml will be managed and imported. Exactly,
 the manifest git will be detected and converted to the actual location to
 import either. (For example, the android manifest git in .repo/manifests is
 acutally in platform/manifest.git within a mirror.)
+
+With the option "--native-fetch", the projects are fetched with git directly
+instead of "repo sync". Only the projects whose upstream heads or tags are
+different from the mirror are fetched.
+
+With the option "--loop", the command keeps running and polls the projects
+with the native fetch. The manifest, the gerrit projects and the remote refs
+are kept between the cycles. Each project is polled with its own interval,
+which is shortened once the project changes and lengthened while it doesn't.
+
+With the option "--stream-events", the loop mirrors the projects and refs in
+the "ref-updated" events of "gerrit stream-events" from the upstream as soon
+as they are read, the polling could be left with a long interval to
+reconcile the missed events.
 """
 
     def options(self, optparse):
         RepoSubcmd.options(self, optparse)
         optparse.suppress_opt('--mirror', True)
 
+        options = optparse.get_option_group('--pipeline') or \
+            optparse.add_option_group('Other options')
+        options.add_option(
+            '--native-fetch',
+            dest='native_fetch', action='store_true',
+            help='Fetch the projects in the manifest with git directly '
+                 'instead of "repo sync" and skip the projects whose '
+                 'upstream heads and tags are unchanged')
+
+        options = optparse.add_option_group('Loop options')
+        options.add_option(
+            '--loop',
+            dest='loop', action='store_true',
+            help='Keep running to poll and mirror the changed projects with '
+                 'the native fetch instead of exiting after a run')
+        options.add_option(
+            '--poll-interval',
+            dest='poll_interval', action='store', type='int', default=60,
+            metavar='SECONDS',
+            help='Set the interval to poll a changed project: %default')
+        options.add_option(
+            '--max-poll-interval',
+            dest='max_poll_interval', action='store', type='int',
+            default=3600, metavar='SECONDS',
+            help='Set the longest interval to poll an unchanged project, '
+                 'the interval is doubled each time a project is polled '
+                 'unchanged: %default')
+        options.add_option(
+            '--manifest-interval',
+            dest='manifest_interval', action='store', type='int',
+            default=900, metavar='SECONDS',
+            help='Set the interval to update the manifest: %default')
+        options.add_option(
+            '--loop-cycles',
+            dest='loop_cycles', action='store', type='int',
+            metavar='CYCLES',
+            help='Exit after the cycles, it runs until interrupted by '
+                 'default')
+
+        EventStream.options(optparse)
+
+    def init_and_sync(self, options, offsite=False, update=True, sync=True):
+        if offsite or not options.native_fetch:
+            return RepoSubcmd.init_and_sync(
+                self, options, offsite, update, sync)
+
+        # "repo init" updates the manifest only
+        repo = RepoSubcmd.init_and_sync(
+            self, options, offsite, update, sync=False)
+        if not sync:
+            return repo
+
+        projects = RepoMirrorSubcmd.fetch_projects_in_manifest(
+            options, existing=False)
+        if not self.run_with_thread(  # pylint: disable=E1101
+                options.job, projects, RepoMirrorSubcmd.fetch, options,
+                options=options):
+            if options.force:
+                self.get_logger().error(  # pylint: disable=E1101
+                    'Failed to fetch "%s"' % options.manifest)
+            else:
+                raise DownloadError(
+                    'Failed to fetch "%s"' % options.manifest)
+
+        self.do_hook(  # pylint: disable=E1101
+            'post-sync', options, dryrun=options.dryrun)
+
+        return repo
+
+    @staticmethod
+    def fetch(project, options):
+        """Fetches the project alone with git or "repo sync"."""
+        if not options.native_fetch:
+            return RepoSubcmd.fetch(project, options)
+
+        # the included manifest project has been initialized
+        if not project.fetch_url:
+            return True
+
+        logger = RepoMirrorSubcmd.get_logger(  # pylint: disable=E1101
+            name=str(project))
+        logger.info('Start fetching ...')
+
+        ret, _ = project.fetch_mirror(project.fetch_url, logger=logger)
+        if ret != 0:
+            logger.error('failed to fetch')
+            return False
+
+        return True
+
     @staticmethod
-    def fetch_projects_in_manifest(options, filename=None):
+    def fetch_projects_in_manifest(options, filename=None, existing=True):
         manifest = RepoMirrorSubcmd.get_manifest(options, filename)
 
         projects = list()
@@ -38,10 +146,11 @@ acutally in platform/manifest.git within a mirror.)
         pattern = RepoSubcmd.get_patterns(options)  # pylint: disable=E1101
 
         for node in manifest.get_projects():
+            url = '%s/%s' % (manifest.get_fetch_url(node.remote), node.name)
             path = os.path.join(
                 RepoMirrorSubcmd.get_absolute_working_dir(options),  # pylint: disable=E1101
                 '%s.git' % node.name)
-            if not os.path.exists(path):
+            if existing and not os.path.exists(path):
                 logger.warning('%s not existed, ignored', path)
                 continue
             elif not pattern.match('project', node.name):
@@ -61,9 +170,284 @@ acutally in platform/manifest.git within a mirror.)
                     bare=True,
                     pattern=pattern,
                     source=node.name,
+                    fetch_url=url,
                     copyfiles=node.copyfiles,
                     linkfiles=node.linkfiles))
 
         RepoSubcmd.include_project_manifest(options, projects, pattern)
 
         return projects
+
+    @staticmethod
+    def poll(project, gerrit, options, remote,  # pylint: disable=R0913
+             state, schedule, pushed, updates=None):
+        """Fetches the project if the upstream is changed, or the refs in
+        "updates" from the events, and pushes it if fetched or never pushed
+        by the loop."""
+        logger = RepoMirrorSubcmd.get_logger(  # pylint: disable=E1101
+            name=str(project))
+
+        refs = (updates or dict()).get(project.uri)
+        ret, changed = project.fetch_mirror(
+            project.fetch_url, logger=logger, refs=refs)
+        # the events don't change the schedule of the polls
+        polled = not refs
+        if ret != 0:
+            logger.error('failed to fetch')
+            if polled:
+                schedule.update(project.uri, None)
+            return False
+
+        if changed or project.uri not in pushed:
+            if not RepoSubcmd.push(project, gerrit, options, remote, state):
+                # poll it again soon to push
+                schedule.update(project.uri, True)
+                return False
+
+            pushed.add(project.uri)
+
+        if polled:
+            logger.debug(
+                'poll again in %ds', schedule.update(project.uri, changed))
+
+        return True
+
+    @staticmethod
+    def updated_refs(updates):
+        """Returns the mirrored refs in the RefUpdate list, or None to poll
+        the project if any of them is deleted."""
+        refs = set()
+        for update in updates:
+            if not update.ref.startswith(('refs/heads/', 'refs/tags/')):
+                continue
+            elif update.deleted():
+                return None
+
+            refs.add(update.ref)
+
+        return sorted(refs)
+
+    @staticmethod
+    def follow_events(options, pending, lock, wakeup):
+        """Starts the thread to read the events and record the RefUpdate in
+        "pending" by the upstream project names. Returns the stream."""
+        stream = EventStream(options.stream_events)
+
+        def _follow():
+            for update in stream.updates():
+                with lock:
+                    pending.setdefault(update.project, list()).append(update)
+                wakeup.set()
+
+        thread = threading.Thread(target=_follow)
+        thread.daemon = True
+        thread.start()
+
+        return stream
+
+    def _mirror_events(self, options, projects, pending, lock, *args):
+        """Mirrors the projects with the pending events and returns their
+        names."""
+        with lock:
+            events = dict(pending)
+            pending.clear()
+
+        if not events:
+            return set()
+
+        sources = dict(
+            (project.source, project) for project in projects.values())
+
+        updates = dict()
+        for name, items in events.items():
+            if name not in sources:
+                self.get_logger().debug(  # pylint: disable=E1101
+                    'event of %s ignored', name)
+                continue
+
+            refs = RepoMirrorSubcmd.updated_refs(items)
+            if refs is None or refs:
+                updates[sources[name].uri] = refs
+
+        if updates:
+            results = self.run_tasks(  # pylint: disable=E1101
+                options.job, [projects[uri] for uri in sorted(updates)],
+                RepoMirrorSubcmd.poll, *(args + (updates,)),
+                options=options)
+            self._report_results(results)  # pylint: disable=E1101
+
+        return set(updates)
+
+    @staticmethod
+    def _manifest_key(options):
+        """Returns the modified times of the manifest files to detect the
+        changes of the manifest."""
+        working_dir = RepoMirrorSubcmd.get_absolute_working_dir(options)  # pylint: disable=E1101
+        filenames = [
+            RepoMirrorSubcmd.get_absolute_running_file_name(  # pylint: disable=E1101
+                options, options.manifest_xml_file or '.repo/manifest.xml')]
+
+        manifests = os.path.join(working_dir, '.repo/manifests')
+        if os.path.isdir(manifests):
+            for name in sorted(os.listdir(manifests)):
+                if name.endswith('.xml'):
+                    filenames.append(os.path.join(manifests, name))
+
+        key = list()
+        for filename in filenames:
+            if os.path.exists(filename):
+                stat = os.stat(os.path.realpath(filename))
+                key.append((filename, stat.st_mtime, stat.st_size))
+
+        return key
+
+    def _update_projects(self, options, projects, gerrit, remote, cache):
+        """Updates the projects with the manifest, the existed projects are
+        kept with their remote refs. Returns the new projects."""
+        new_projects = list()
+        latest = dict()
+        for project in RepoMirrorSubcmd.fetch_projects_in_manifest(
+                options, existing=False):
+            if not project.fetch_url:
+                continue
+
+            origin = projects.get(project.uri)
+            if origin is not None and origin.fetch_url == project.fetch_url \
+                    and origin.revision == project.revision:
+                latest[project.uri] = origin
+                continue
+
+            if not options.repo_create and not gerrit.has_project(
+                    project.source) and not gerrit.has_project(project.uri):
+                self.get_logger().warning(  # pylint: disable=E1101
+                    'new project %s ignored', project.uri)
+                continue
+
+            project.set_ref_cache(cache)
+            latest[project.uri] = project
+            new_projects.append(project)
+
+        if new_projects and not options.dryrun and remote \
+                and options.repo_create:
+            gerrit.create_projects(
+                [project.uri for project in new_projects],
+                jobs=options.job, options=options)
+
+        if new_projects and options.gerrit_heads_inventory and remote:
+            RepoSubcmd.load_heads_inventory(new_projects, gerrit, options)
+
+        projects.clear()
+        projects.update(latest)
+
+        return new_projects
+
+    def run_loop(self, options):
+        """Polls and mirrors the projects in cycles until interrupted or
+        the cycles are done."""
+        logger = self.get_logger()  # pylint: disable=E1101
+
+        remote = RepoSubcmd.parse_remote(options)
+        working_dir = RepoMirrorSubcmd.get_absolute_working_dir(options)  # pylint: disable=E1101
+
+        gerrit = Gerrit(remote, options)
+        gerrit.set_inventory(GerritInventory.build(options, working_dir))
+        cache = RemoteRefCache.build(options, working_dir)
+        state = MirrorState.build(options, working_dir)
+        schedule = PollSchedule(
+            options.poll_interval, options.max_poll_interval)
+
+        repo = self.init_and_sync(options, sync=False)
+
+        pending, lock, wakeup = dict(), threading.Lock(), threading.Event()
+        stream = None
+        if options.stream_events:
+            stream = RepoMirrorSubcmd.follow_events(
+                options, pending, lock, wakeup)
+
+        projects, pushed = dict(), set()
+        # the manifest has been updated by init_and_sync()
+        manifest_key, manifest_time = None, time.time()
+
+        cycles = 0
+        while not options.loop_cycles or cycles < options.loop_cycles:
+            cycles += 1
+
+            now = time.time()
+            if now - manifest_time >= options.manifest_interval:
+                manifest_time = now
+                if repo.init():
+                    logger.error('failed to update the manifest')
+
+            key = RepoMirrorSubcmd._manifest_key(options)
+            if key != manifest_key:
+                try:
+                    new_projects = self._update_projects(
+                        options, projects, gerrit, remote, cache)
+                except Exception as e:  # pylint: disable=W0703
+                    # load it again in the next cycle
+                    logger.exception(e)
+                else:
+                    manifest_key = key
+                    schedule.retain(projects)
+                    logger.info(
+                        'manifest loaded with %d projects, %d new',
+                        len(projects), len(new_projects))
+
+            wakeup.clear()
+            mirrored = self._mirror_events(
+                options, projects, pending, lock, gerrit, options, remote,
+                state, schedule, pushed)
+            if mirrored:
+                logger.info(
+                    'cycle %d: %d projects mirrored by the events', cycles,
+                    len(mirrored))
+
+            due = [projects[uri] for uri in schedule.due(projects)
+                   if uri not in mirrored]
+            if due:
+                results = self.run_tasks(  # pylint: disable=E1101
+                    options.job, due, RepoMirrorSubcmd.poll, gerrit,
+                    options, remote, state, schedule, pushed,
+                    options=options)
+                for result in results:
+                    if result.exception is not None:
+                        # poll it again in the interval kept
+                        schedule.update(result.task.uri, None)
+
+                self._report_results(results)  # pylint: disable=E1101
+                logger.info(
+                    'cycle %d: %d of %d projects polled', cycles,
+                    len(due), len(projects))
+
+            if options.loop_cycles and cycles >= options.loop_cycles:
+                break
+
+            timeout = min(
+                schedule.next_time(projects) or now + options.poll_interval,
+                manifest_time + options.manifest_interval) - time.time()
+            # wake up by the events as well
+            wakeup.wait(max(timeout, 1))
+
+        if stream is not None:
+            stream.close()
+
+        return True
+
+    def execute(self, options, *args, **kws):
+        if not options.loop and not options.stream_events:
+            return RepoSubcmd.execute(self, options, *args, **kws)
+
+        SubCommandWithThread.execute(self, options, *args, **kws)
+        RaiseExceptionIfOptionMissed(
+            options.remote, 'remote (--remote) is not set')
+
+        if options.prefix and not options.prefix.endswith('/'):
+            options.prefix += '/'
+
+        # the changes of the projects are detected by the native fetch
+        options.native_fetch = True
+        options.loop = True
+        # a failed project mustn't stop the loop or the other projects
+        options.keep_going = True
+
+        return self.run_loop(options)
@@ -1,5 +1,6 @@
 
 import os
+import threading
 
 try:
     from urllib.parse import urlparse
@@ -7,9 +8,10 @@ except ImportError:
     from urlparse import urlparse
 
 from options import Values
-from topics import DownloadError, FileUtils, Gerrit, GitProject, Manifest,  \
-    ManifestBuilder, Pattern, RaiseExceptionIfOptionMissed, RepoProject, \
-    SubCommandWithThread
+from topics import CommandLoop, DownloadError, FileUtils, Gerrit, \
+    GerritInventory, GitProject, Manifest, ManifestBuilder, MirrorState, \
+    Pattern, RaiseExceptionIfOptionMissed, RemoteRefCache, RepoProject, \
+    SubCommandWithThread, TaskHistory
 
 
 def sort_project(project):
@@ -37,6 +39,9 @@ Not like the sub-command "repo-mirror", the manifest git would be handled with
 this command.
 """
 
+    # serializes the syncs of the projects with the old repo
+    SYNC_LOCK = threading.Lock()
+
     def options(self, optparse, inherited=False, modules=None):
         SubCommandWithThread.options(
             self, optparse, option_remote=True,
@@ -88,6 +93,30 @@ this command.
                 '--include-init-manifest',
                 dest='include_init_manifest', action='store_true',
                 help='Include .repo/manifests if mirror didn\'t contain it')
+            options.add_option(
+                '--event-loop',
+                dest='event_loop', action='store_true',
+                help='Run ls-remote and git push of all projects as child '
+                     'processes on a single asyncio event loop instead of '
+                     'threads. The option "-j" limits the processes in '
+                     'flight')
+            options.add_option(
+                '--pipeline',
+                dest='pipeline', action='store_true',
+                help='Sync the projects one by one and push each project as '
+                     'soon as it\'s synced instead of syncing all projects '
+                     'before pushing')
+            options.add_option(
+                '--fetch-jobs',
+                dest='fetch_jobs', action='store', type='int', metavar='JOBS',
+                help='Sync the projects with the jobs in parallel in the '
+                     'pipeline, the default is the option "-j"')
+            options.add_option(
+                '--pipeline-depth',
+                dest='pipeline_depth', action='store', type='int',
+                metavar='NUMBER',
+                help='Limit the synced projects waiting to push in the '
+                     'pipeline, the default is the option "-j"')
 
             options = optparse.add_option_group('Extra action options')
             options.add_option(
@@ -138,7 +167,8 @@ this command.
         return Manifest(
             filename=manifest,
             refspath=os.path.dirname(refsp),
-            mirror=mirror or (options is not None and options.mirror))
+            mirror=mirror or (options is not None and options.mirror),
+            basedir=working_dir)
 
     @staticmethod
     def include_project_manifest(options, projects, pattern):
@@ -161,16 +191,18 @@ this command.
                 options.remote)
 
     @staticmethod
-    def fetch_projects_in_manifest(options, filename=None):
+    def fetch_projects_in_manifest(options, filename=None, existing=True):
         manifest = RepoSubcmd.get_manifest(options, filename)
 
         projects = list()
         logger = RepoSubcmd.get_logger()  # pylint: disable=E1101
         pattern = RepoSubcmd.get_patterns(options)  # pylint: disable=E1101
+        working_dir = RepoSubcmd.get_absolute_working_dir(options)  # pylint: disable=E1101
 
         for node in manifest.get_projects():
-            if not os.path.exists(node.path) and \
-                    not options.convert_manifest_file:
+            if existing and \
+                    not os.path.exists(os.path.join(working_dir, node.path)) \
+                    and not options.convert_manifest_file:
                 logger.warning('%s not existed, ignored', node.path)
                 continue
             elif not pattern.match('project', node.name):
@@ -183,8 +215,7 @@ this command.
 
             project = GitProject(
                 name,
-                worktree=os.path.join(
-                    RepoSubcmd.get_absolute_working_dir(options), node.path),  # pylint: disable=E1101
+                worktree=os.path.join(working_dir, node.path),
                 remote='%s/%s' % (options.remote, name),
                 pattern=pattern,
                 source=node.name,
@@ -203,7 +234,7 @@ this command.
 
         return projects
 
-    def init_and_sync(self, options, offsite=False, update=True):
+    def init_and_sync(self, options, offsite=False, update=True, sync=True):
         self.do_hook(  # pylint: disable=E1101
             'pre-init', options, dryrun=options.dryrun)
 
@@ -215,7 +246,8 @@ this command.
 
         if offsite:
             return repo
-        if not repo.exists():
+        existed = repo.exists()
+        if not existed:
             RaiseExceptionIfOptionMissed(
                 options.manifest, 'manifest (--manifest) is not set')
 
@@ -231,6 +263,15 @@ this command.
         self.do_hook('pre-sync', options, dryrun=options.dryrun)
         # pylint: enable=E1101
 
+        # the projects will be synced one by one in the pipeline without
+        # updating the manifest, which is updated by "repo init" once
+        if not sync:
+            if existed and repo.init():
+                raise DownloadError(
+                    'Failed to update "%s"' % options.manifest)
+
+            return repo
+
         res = repo.sync()
         if res:
             if options.force:
@@ -246,65 +287,206 @@ this command.
         return repo
 
     @staticmethod
-    def push(project, gerrit, options, remote):
-        project_name = str(project)
+    def fetch(project, options):
+        """Syncs the project alone in the pipeline."""
+        # the included manifest project has been initialized
+        if not project.source:
+            return True
+
         logger = RepoSubcmd.get_logger(  # pylint: disable=E1101
-            name=project_name)
+            name=str(project))
+        logger.info('Start syncing ...')
 
-        logger.info('Start processing ...')
-        if not options.dryrun and remote:
-            gerrit.create_project(project.uri, options=options)
+        repo = RepoProject(
+            options.manifest,
+            RepoSubcmd.get_absolute_working_dir(options),  # pylint: disable=E1101
+            options.manifest_branch, options=options)
 
-        RepoSubcmd.do_hook(  # pylint: disable=E1101
-            'pre-push', options, dryrun=options.dryrun)
+        # fetch the project alone, the mirror has no work tree to update
+        args = ['--network-only'] if options.mirror else list()
+        # the syncs in parallel would race to update the manifest and the
+        # shared state of the client, which run one by one if the manifest
+        # can't be skipped by the old repo
+        serial = not repo.has_option('sync', '--no-manifest-update')
+        if not serial:
+            args.append('--no-manifest-update')
+
+        if serial:
+            RepoSubcmd.SYNC_LOCK.acquire()
+        try:
+            ret = repo.sync(*(args + [project.source]))
+        finally:
+            if serial:
+                RepoSubcmd.SYNC_LOCK.release()
+
+        if ret:
+            logger.error('failed to sync')
+            return False
 
+        return True
+
+    @staticmethod
+    def push_arguments(options):
+        """Returns the keywords of push_heads and push_tags, either is None
+        if the heads or tags aren't pushed."""
+        heads, tags = None, None
         optgp = options.extra_values(options.extra_option, 'git-push')
 
-        # push the heads
         if RepoSubcmd.override_value(  # pylint: disable=E1101
                 options.heads, options.all):
-            optp = Values.build(
-                extra=optgp,
-                push_all=options.all or (
-                    options.head_pattern and options.heads),
-                fullname=options.keep_name,
-                sha1tag=options.sha1_tag,
-                git_repo=True,
-                mirror=options.mirror)
-
-            res = project.push_heads(
-                project.revision,
-                RepoSubcmd.override_value(  # pylint: disable=E1101
+            heads = dict(
+                refs=RepoSubcmd.override_value(  # pylint: disable=E1101
                     options.refs, options.head_refs),
-                options.head_pattern,
-                options=optp,
-                force=options.force,
-                dryrun=options.dryrun,
-                logger=logger)
-            if res != 0:
-                logger.error('failed to push heads')
-
-        # push the tags
+                patterns=options.head_pattern,
+                options=Values.build(
+                    extra=optgp,
+                    push_all=options.all or (
+                        options.head_pattern and options.heads),
+                    fullname=options.keep_name,
+                    sha1tag=options.sha1_tag,
+                    git_repo=True,
+                    mirror=options.mirror),
+                force=options.force)
+
         if RepoSubcmd.override_value(  # pylint: disable=E1101
                 options.tags, options.all):
-            optp = Values.build(
-                extra=optgp,
-                fullname=options.keep_name)
-
-            res = project.push_tags(
-                None, RepoSubcmd.override_value(  # pylint: disable=E1101
+            tags = dict(
+                refs=RepoSubcmd.override_value(  # pylint: disable=E1101
                     options.refs, options.tag_refs),
-                options.tag_pattern,
-                options=optp,
-                force=options.force,
-                dryrun=options.dryrun,
-                logger=logger)
-            if res != 0:
-                logger.error('failed to push tags')
+                patterns=options.tag_pattern,
+                options=Values.build(
+                    extra=optgp,
+                    fullname=options.keep_name),
+                force=options.force)
+
+        return heads, tags
+
+    @staticmethod
+    def is_unchanged(project, options, state, logger):
+        """Loads the local refs and checks them with the MirrorState."""
+        if state is None:
+            return False
+
+        project.load_local_refs()
+        if state.unchanged(
+                project.uri, project.remote, project.local_refs,
+                *MirrorState.extras(options, project.revision)):
+            logger.info('local refs are unchanged since the last push, skip')
+            return True
+
+        return False
+
+    @staticmethod
+    def save_state(project, options, state, refs):
+        if state is not None and refs is not None and not options.dryrun:
+            state.save(
+                project.uri, project.remote, refs,
+                *MirrorState.extras(options, project.revision))
+
+    @staticmethod
+    def load_heads_inventory(projects, gerrit, options):
+        """Lists the remote heads of the pushed branches of all projects with
+        gerrit at once and sets them to the projects."""
+        heads, tags = RepoSubcmd.push_arguments(options)
+        if heads is None:
+            return
+
+        branches = set()
+        for project in projects:
+            for refspec in project.refs_refspecs(
+                    dict(heads, branch=project.revision), tags,
+                    logger=RepoSubcmd.get_logger(  # pylint: disable=E1101
+                        name=str(project))):
+                dest = refspec.partition(':')[2]
+                if dest.startswith('refs/heads/') and '*' not in dest:
+                    branches.add(dest[len('refs/heads/'):])
+
+        ret, inventory = gerrit.ls_heads(sorted(branches))
+        if ret != 0:
+            return
+
+        for project in projects:
+            if project.uri in inventory:
+                project.set_heads_inventory(
+                    branches, inventory[project.uri])
+
+    @staticmethod
+    def push(project, gerrit, options, remote, state=None):  # pylint: disable=W0613
+        # the missing projects have been created by gerrit in execute()
+        project_name = str(project)
+        logger = RepoSubcmd.get_logger(  # pylint: disable=E1101
+            name=project_name)
+
+        logger.info('Start processing ...')
+        if RepoSubcmd.is_unchanged(project, options, state, logger):
+            return True
+
+        # keep the refs before pushing to record in the state
+        refs = project.local_refs
+
+        RepoSubcmd.do_hook(  # pylint: disable=E1101
+            'pre-push', options, dryrun=options.dryrun)
+
+        # push the heads and tags together
+        heads, tags = RepoSubcmd.push_arguments(options)
+        ret = project.push_refs(
+            heads and dict(heads, branch=project.revision),
+            tags,
+            dryrun=options.dryrun,
+            logger=logger)
+        if ret != 0:
+            logger.error('failed to push heads and tags')
+
+        if ret == 0:
+            RepoSubcmd.save_state(project, options, state, refs)
 
         RepoSubcmd.do_hook(  # pylint: disable=E1101
             'post-push', options, dryrun=options.dryrun)
 
+        return ret == 0
+
+    @staticmethod
+    def push_with_loop(projects, gerrit, options, remote, state=None):  # pylint: disable=W0613
+        """Pushes the projects with the commands in a single CommandLoop."""
+        failures = list()
+        loop = CommandLoop(options.job)
+
+        heads, tags = RepoSubcmd.push_arguments(options)
+        for project in projects:
+            logger = RepoSubcmd.get_logger(  # pylint: disable=E1101
+                name=str(project))
+
+            logger.info('Start processing ...')
+            if RepoSubcmd.is_unchanged(project, options, state, logger):
+                continue
+
+            refs = project.local_refs
+
+            RepoSubcmd.do_hook(  # pylint: disable=E1101
+                'pre-push', options, dryrun=options.dryrun)
+
+            def _pushed(ret, project=project, logger=logger, refs=refs):
+                if ret != 0:
+                    logger.error('failed to push')
+                    failures.append(project)
+                else:
+                    RepoSubcmd.save_state(project, options, state, refs)
+
+                RepoSubcmd.do_hook(  # pylint: disable=E1101
+                    'post-push', options, dryrun=options.dryrun)
+
+            project.push_in_loop(
+                loop,
+                heads and dict(heads, branch=project.revision),
+                tags,
+                callback=_pushed,
+                logger=logger,
+                dryrun=options.dryrun)
+
+        loop.run()
+
+        return len(failures) == 0
+
     @staticmethod
     def build_xml_file(options, projects, sort=False):
         origins = dict()
@@ -348,7 +530,7 @@ this command.
 
     @staticmethod
     def build_map_file(options, projects):
-        with open(options.map_file, 'w') as fp:
+        with open(FileUtils.absolute_path(options.map_file), 'w') as fp:
             for project in projects:
                 if project.uri != project.source:
                     fp.write('%s -> %s' % (project.uri, project.source))
@@ -376,11 +558,12 @@ this command.
         projects.sort(key=sort_project_path)
 
         if options.map_file:
-            if not os.path.exists(options.map_file):
+            map_file = FileUtils.absolute_path(options.map_file)
+            if not os.path.exists(map_file):
                 RepoSubcmd.build_map_file(options, projects)
 
-            if os.path.exists(options.map_file):
-                with open(options.map_file, 'r') as fp:
+            if os.path.exists(map_file):
+                with open(map_file, 'r') as fp:
                     for line in fp.readlines():
                         nname, _, origin = line.split(' ', 2)
                         maps[origin] = nname
@@ -469,6 +652,19 @@ this command.
 
         return True
 
+    @staticmethod
+    def parse_remote(options):
+        """Returns the gerrit server of the option "remote", which is
+        updated to the git url if it has no scheme."""
+        ulp = urlparse(options.remote)
+        if not ulp.scheme:
+            remote = options.remote
+            options.remote = 'git://%s' % options.remote
+        else:
+            remote = ulp.netloc.strip('/')
+
+        return remote
+
     def execute(self, options, *args, **kws):
         SubCommandWithThread.execute(self, options, *args, **kws)
 
@@ -481,17 +677,22 @@ this command.
         if options.prefix and not options.prefix.endswith('/'):
             options.prefix += '/'
 
-        repo = self.init_and_sync(options, options.offsite)
+        pipeline = options.pipeline and not options.offsite
+        repo = self.init_and_sync(options, options.offsite, sync=not pipeline)
 
-        ulp = urlparse(options.remote)
-        if not ulp.scheme:
-            remote = options.remote
-            options.remote = 'git://%s' % options.remote
-        else:
-            remote = ulp.netloc.strip('/')
+        remote = RepoSubcmd.parse_remote(options)
+        working_dir = RepoSubcmd.get_absolute_working_dir(options)  # pylint: disable=E1101
 
         gerrit = Gerrit(remote, options)
-        projects = self.fetch_projects_in_manifest(options)
+        gerrit.set_inventory(GerritInventory.build(options, working_dir))
+        projects = self.fetch_projects_in_manifest(
+            options, existing=not pipeline)
+
+        cache = RemoteRefCache.build(options, working_dir)
+        for project in projects:
+            project.set_ref_cache(cache)
+
+        state = MirrorState.build(options, working_dir)
 
         if options.print_new_projects or options.dump_projects or \
                 not options.repo_create:
@@ -522,5 +723,43 @@ this command.
 
             return
 
+        # create the missing projects before pushing
+        if not options.dryrun and remote:
+            gerrit.create_projects(
+                [project.uri for project in projects
+                 if state is None
+                 or not state.has(project.uri, project.remote)],
+                jobs=options.job, options=options)
+
+        if options.gerrit_heads_inventory and remote:
+            if pipeline:
+                # the local refs aren't fetched yet to decide the branches
+                self.get_logger().warning(  # pylint: disable=E1101
+                    'heads inventory ignored in the pipeline')
+            else:
+                RepoSubcmd.load_heads_inventory(projects, gerrit, options)
+
+        history = TaskHistory.build(options, working_dir)
+        if pipeline:
+            ret = self.run_with_pipeline(  # pylint: disable=E1101
+                options.job, projects,
+                lambda project: self.fetch(project, options),
+                RepoSubcmd.push, gerrit, options, remote, state,
+                history=history, fetch_jobs=options.fetch_jobs,
+                depth=options.pipeline_depth, options=options)
+            self.do_hook(  # pylint: disable=E1101
+                'post-sync', options, dryrun=options.dryrun)
+
+            return ret
+
+        if options.event_loop:
+            if CommandLoop.available():
+                return RepoSubcmd.push_with_loop(
+                    projects, gerrit, options, remote, state)
+
+            self.get_logger().warning(  # pylint: disable=E1101
+                'event loop unavailable, push with threads instead')
+
         return self.run_with_thread(  # pylint: disable=E1101
-            options.job, projects, RepoSubcmd.push, gerrit, options, remote)
+            options.job, projects, RepoSubcmd.push, gerrit, options, remote,
+            state, history=history, options=options)
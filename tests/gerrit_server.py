@@ -0,0 +1,152 @@
+"""A small stand-in of the Gerrit REST API for the tests.
+
+It serves the listing, the creation of the projects and the branches over
+the keep-alive HTTP/1.1 connections, and records the requests."""
+
+import json
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
+
+
+MAGIC = ")]}'"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        pass
+
+    def _reply(self, status, data=None):
+        # read the modes before replying, which may be changed by the test
+        # once the response is received
+        truncate, close_idle = self.server.truncate, self.server.close_idle
+        content = (MAGIC + '\n' + json.dumps(data)).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if truncate:
+            # declare more than sent to fail the client reading the body
+            self.send_header('Content-Length', str(len(content) + 100))
+        else:
+            self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+        if truncate or close_idle:
+            # close the kept connection as an idle timeout of the server
+            self.close_connection = True
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8') or 'null')
+
+    def do_GET(self):  # pylint: disable=C0103
+        ulp = urlparse(self.path)
+        self.server.record('GET', ulp.path)
+        if ulp.path != '/projects/':
+            return self._reply(404, 'not found')
+
+        query = parse_qs(ulp.query, keep_blank_values=True)
+        limit = int(query.get('n', ['0'])[0]) or None
+        start = int(query.get('S', ['0'])[0])
+        prefix = query.get('p', [''])[0]
+        branches = query.get('b', list())
+
+        with self.server.lock:
+            names = sorted(
+                name for name in self.server.projects
+                if name.startswith(prefix))
+            page = dict()
+            for name in names[start:limit and start + limit]:
+                info = dict(id=name)
+                heads = dict(
+                    (branch, self.server.projects[name][branch])
+                    for branch in branches
+                    if branch in self.server.projects[name])
+                if branches:
+                    info['branches'] = heads
+
+                page[name] = info
+
+        return self._reply(200, page)
+
+    def do_PUT(self):  # pylint: disable=C0103
+        path = urlparse(self.path).path
+        self.server.record('PUT', path)
+        data = self._read_body()
+
+        parts = path.split('/')
+        if len(parts) == 3 and parts[1] == 'projects':
+            name = unquote(parts[2])
+            with self.server.lock:
+                if name in self.server.projects:
+                    return self._reply(409, 'Project already exists')
+
+                heads = dict()
+                if data.get('create_empty_commit'):
+                    for branch in data.get('branches') or ['master']:
+                        heads[branch] = '1' * 40
+                self.server.projects[name] = heads
+
+            return self._reply(201, dict(id=name, name=name))
+        elif len(parts) == 5 and parts[1] == 'projects' and \
+                parts[3] == 'branches':
+            name, branch = unquote(parts[2]), unquote(parts[4])
+            with self.server.lock:
+                heads = self.server.projects.get(name)
+                if heads is None:
+                    return self._reply(404, 'Not found: %s' % name)
+                elif branch in heads:
+                    return self._reply(409, 'branch already exists')
+
+                heads[branch] = data.get('revision') or '2' * 40
+
+            return self._reply(201, dict(ref='refs/heads/%s' % branch))
+
+        return self._reply(404, 'not found')
+
+
+class GerritServer(ThreadingMixIn, HTTPServer):
+    """Runs the stand-in on a free local port in a daemon thread.
+
+    "projects" is the dict of the project to the dict of the branch to
+    SHA-1. "close_idle" closes the connection after each response, and
+    "truncate" sends a shorter body than declared."""
+
+    daemon_threads = True
+
+    def __init__(self, projects=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+
+        self.lock = threading.Lock()
+        self.projects = dict(projects or dict())
+        self.requests = list()
+        self.close_idle = False
+        self.truncate = False
+        self.thread = None
+
+    def record(self, method, path):
+        with self.lock:
+            self.requests.append((method, path))
+
+    def get_url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
@@ -0,0 +1,122 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from options import Values  # noqa: E402
+from topics import CommandGovernor  # noqa: E402
+
+# raised with the error module imported by the governor
+KrepError = sys.modules[CommandGovernor.__module__].KrepError
+
+
+class CommandGovernorTest(unittest.TestCase):
+    def tearDown(self):
+        CommandGovernor.GOVERNOR = None
+
+    @staticmethod
+    def _acquire(governor, name, slots=1):
+        """Returns the thread taking the slots and the event set once they're
+        taken, the thread releases them once "release" is set."""
+        acquired, release = threading.Event(), threading.Event()
+
+        def _run():
+            handle = governor.acquire(name, slots)
+            acquired.set()
+            release.wait(10)
+            governor.release(handle)
+
+        thread = threading.Thread(target=_run)
+        thread.daemon = True
+        thread.start()
+
+        return thread, acquired, release
+
+    def test_build(self):
+        self.assertIsNone(CommandGovernor.build(Values.build()))
+
+        governor = CommandGovernor.build(Values.build(
+            max_processes=8, process_limit=['fetch=4', 'push=2']))
+        self.assertEqual(8, governor.limit)
+        self.assertEqual(dict(fetch=4, push=2), governor.limits)
+        self.assertIs(governor, CommandGovernor.get())
+
+    def test_build_invalid(self):
+        for item in ('network=2', 'fetch', 'fetch=two'):
+            self.assertRaises(
+                KrepError, CommandGovernor.build,
+                Values.build(process_limit=[item]))
+
+    def test_class_limit(self):
+        governor = CommandGovernor(limits=dict(fetch=1))
+
+        first, acquired, release_first = self._acquire(governor, 'fetch')
+        self.assertTrue(acquired.wait(5))
+
+        # the second fetch waits for the first one
+        second, waiting, release_second = self._acquire(governor, 'fetch')
+        self.assertFalse(waiting.wait(0.2))
+
+        # but the other classes aren't limited
+        third, pushed, release_third = self._acquire(governor, 'push')
+        self.assertTrue(pushed.wait(5))
+        self.assertEqual(
+            dict(fetch=1, push=1, ssh=0, local=0, total=2),
+            governor.counts())
+
+        release_first.set()
+        self.assertTrue(waiting.wait(5))
+
+        release_second.set()
+        release_third.set()
+        for thread in (first, second, third):
+            thread.join()
+
+        self.assertEqual(0, governor.counts()['total'])
+        peaks = governor.get_peaks()
+        self.assertEqual((1, 1, 2), (
+            peaks['fetch'], peaks['push'], peaks['total']))
+
+    def test_total_limit(self):
+        governor = CommandGovernor(limit=2)
+
+        threads = [self._acquire(governor, name) for name in ('ssh', 'push')]
+        for _, acquired, _ in threads:
+            self.assertTrue(acquired.wait(5))
+
+        # the unknown class is counted as "local"
+        thread, acquired, release = self._acquire(governor, 'unknown')
+        self.assertFalse(acquired.wait(0.2))
+
+        threads[0][2].set()
+        self.assertTrue(acquired.wait(5))
+        self.assertEqual(1, governor.counts()['local'])
+
+        release.set()
+        threads[1][2].set()
+        for item in threads + [(thread, acquired, release)]:
+            item[0].join()
+
+    def test_large_command_alone(self):
+        governor = CommandGovernor(limit=2, limits=dict(push=1))
+
+        # more slots than the limit run once nothing else is running
+        handle = governor.acquire('push', 3)
+        self.assertEqual(3, governor.counts()['total'])
+        governor.release(handle)
+
+    def test_nested_not_blocked(self):
+        governor = CommandGovernor(limit=1)
+
+        with governor.slot('fetch'):
+            # a command started by the thread holding a slot
+            with governor.slot('local'):
+                self.assertEqual(2, governor.counts()['total'])
+
+        self.assertEqual(0, governor.counts()['total'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from krep_subcmds import all_commands  # noqa: E402
+from topics import EventStream, RefUpdate  # noqa: E402
+
+
+SHA1_OLD = 'a' * 40
+SHA1_NEW = 'b' * 40
+
+
+def _event(project, ref, new=SHA1_NEW, kind='ref-updated'):
+    return json.dumps(dict(type=kind, refUpdate=dict(
+        project=project, refName=ref, oldRev=SHA1_OLD, newRev=new)))
+
+
+class EventStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='krep-test-')
+        self.updated_refs = type(all_commands['repo-mirror']).updated_refs
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _stream(self, lines):
+        filename = os.path.join(self.tmpdir, 'events.json')
+        with open(filename, 'w') as fp:
+            fp.write('\n'.join(lines) + '\n')
+
+        return EventStream(filename)
+
+    def test_read_file(self):
+        stream = self._stream([
+            _event('platform/build', 'refs/heads/master'),
+            '{"type": "ref-updated", "refUpdate": ',
+            '',
+            '["ref-updated"]',
+            _event('platform/build', 'refs/heads/master', kind='comment'),
+            _event('', 'refs/heads/master'),
+            _event('platform/build', ''),
+            _event('tools/repo', 'stable'),
+            _event('tools/repo', 'refs/tags/v1.0', new=RefUpdate.NULL_SHA1),
+        ])
+
+        self.assertTrue(stream.is_file())
+        self.assertEqual([
+            RefUpdate('platform/build', 'refs/heads/master', SHA1_OLD,
+                      SHA1_NEW),
+            RefUpdate('tools/repo', 'refs/heads/stable', SHA1_OLD, SHA1_NEW),
+            RefUpdate('tools/repo', 'refs/tags/v1.0', SHA1_OLD,
+                      RefUpdate.NULL_SHA1),
+        ], list(stream.updates()))
+
+    def test_parse(self):
+        self.assertIsNone(EventStream.parse('not json'))
+        self.assertIsNone(EventStream.parse('"ref-updated"'))
+        self.assertIsNone(EventStream.parse(
+            '{"type": "ref-updated", "refUpdate": null}'))
+
+        update = EventStream.parse(_event('p', 'refs/changes/01/1/1'))
+        self.assertEqual('refs/changes/01/1/1', update.ref)
+        self.assertFalse(update.deleted())
+
+        update = EventStream.parse(_event('p', 'dev', RefUpdate.NULL_SHA1))
+        self.assertEqual('refs/heads/dev', update.ref)
+        self.assertTrue(update.deleted())
+
+    def test_updated_refs(self):
+        updates = list(self._stream([
+            _event('p', 'master'),
+            _event('p', 'refs/tags/v1'),
+            _event('p', 'refs/heads/master'),
+            _event('p', 'refs/changes/01/1/1'),
+            _event('p', 'refs/meta/config'),
+        ]).updates())
+
+        self.assertEqual(
+            ['refs/heads/master', 'refs/tags/v1'],
+            self.updated_refs(updates))
+        self.assertEqual([], self.updated_refs(updates[3:]))
+
+    def test_updated_refs_deleted(self):
+        updates = list(self._stream([
+            _event('p', 'master'),
+            _event('p', 'refs/tags/v1', new=RefUpdate.NULL_SHA1),
+        ]).updates())
+
+        # the deleted ref needs the whole project to be polled
+        self.assertIsNone(self.updated_refs(updates))
+
+        # but not the deleted refs out of the heads and tags
+        self.assertEqual(['refs/heads/master'], self.updated_refs([
+            updates[0], RefUpdate(
+                'p', 'refs/changes/01/1/1', SHA1_OLD, RefUpdate.NULL_SHA1)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gerrit_server import GerritServer  # noqa: E402
+from topics import GerritRest  # noqa: E402
+
+
+class GerritRestTest(unittest.TestCase):
+    def setUp(self):
+        self.server = GerritServer(dict(
+            ('platform/project-%d' % index, dict(master='%040d' % index))
+            for index in range(5)))
+        self.server.projects['tools/repo'] = dict(stable='f' * 40)
+        self.server.start()
+
+        self.limit = GerritRest.LIMIT
+        GerritRest.LIMIT = 2
+        self.rest = GerritRest(self.server.get_url())
+
+    def tearDown(self):
+        GerritRest.LIMIT = self.limit
+        for connection in self.rest.connections:
+            connection.close()
+        self.server.stop()
+
+    def _requests(self, method):
+        return [req for req in self.server.requests if req[0] == method]
+
+    def test_list_projects_by_pages(self):
+        ret, projects = self.rest.list_projects()
+
+        self.assertEqual(0, ret)
+        self.assertEqual(sorted(self.server.projects), sorted(projects))
+        # 6 projects in 2 per page, and an empty page to end
+        self.assertEqual(4, len(self._requests('GET')))
+        # the connection is kept alive for the pages
+        self.assertEqual(1, len(self.rest.connections))
+
+    def test_list_projects_with_prefix_and_branches(self):
+        ret, projects = self.rest.list_projects(
+            'platform/', branches=['master', 'stable'])
+
+        self.assertEqual(0, ret)
+        self.assertEqual(5, len(projects))
+        self.assertEqual(
+            {'master': '%040d' % 3},
+            projects['platform/project-3']['branches'])
+
+    def test_create_project(self):
+        self.assertEqual(0, self.rest.create_project(
+            'new/project', empty_commit=True, branch='main'))
+        self.assertEqual(
+            {'main': '1' * 40}, self.server.projects['new/project'])
+        self.assertIn(
+            ('PUT', '/projects/new%2Fproject'), self.server.requests)
+
+        # the existing project fails with 409
+        self.assertEqual(1, self.rest.create_project('new/project'))
+
+    def test_create_branch(self):
+        self.assertEqual(0, self.rest.create_branch(
+            'tools/repo', 'next', 'a' * 40))
+        self.assertEqual('a' * 40, self.server.projects['tools/repo']['next'])
+
+        self.assertEqual(1, self.rest.create_branch('tools/repo', 'next'))
+        self.assertEqual(1, self.rest.create_branch('missing', 'next'))
+
+    def test_list_projects_failed(self):
+        rest = GerritRest(self.server.get_url() + '/missing')
+        try:
+            self.assertEqual((1, dict()), rest.list_projects())
+        finally:
+            for connection in rest.connections:
+                connection.close()
+
+    def test_retry_closed_idle_connection(self):
+        self.server.close_idle = True
+        self.rest.list_projects('tools/')
+
+        # the pooled connection was closed by the server and is replaced
+        self.assertEqual(0, self.rest.create_project('other/project'))
+        self.assertIn('other/project', self.server.projects)
+        self.assertEqual(1, len(self._requests('PUT')))
+
+    def test_no_retry_after_sent(self):
+        self.rest.list_projects('tools/')
+
+        self.server.truncate = True
+        self.assertEqual(1, self.rest.create_project('other/project'))
+        # the project created by the server isn't requested again
+        self.assertIn('other/project', self.server.projects)
+        self.assertEqual(1, len(self._requests('PUT')))
+
+
+if __name__ == '__main__':
+    unittest.main()
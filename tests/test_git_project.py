@@ -0,0 +1,167 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from options import Values  # noqa: E402
+from topics import GitProject  # noqa: E402
+
+
+class GitProjectTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='krep-test-')
+        self.worktree = os.path.join(self.tmpdir, 'project')
+        self.remote = os.path.join(self.tmpdir, 'remote.git')
+
+        self._git('init', '-q', self.worktree, cwd=self.tmpdir)
+        self._git('init', '-q', '--bare', self.remote, cwd=self.tmpdir)
+        self.commits = [self._commit(index) for index in range(10)]
+
+        self.project = GitProject(
+            'project', worktree=self.worktree,
+            gitdir=os.path.join(self.worktree, '.git'),
+            remote='file://%s' % self.remote)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _git(self, *args, **kws):
+        return subprocess.check_output(
+            ['git', '-c', 'user.name=krep', '-c', 'user.email=krep@local',
+             '-c', 'init.defaultBranch=master'] + list(args),
+            cwd=kws.get('cwd', self.worktree)).decode('utf-8').strip()
+
+    def _commit(self, index):
+        self._git('commit', '-q', '--allow-empty', '-m', 'commit %d' % index)
+
+        return self._git('rev-parse', 'HEAD')
+
+    def _remote_refs(self):
+        return GitProject._parse_ls_remote(self._git(  # pylint: disable=W0212
+            'ls-remote', '--heads', '--tags', self.remote).split('\n'))
+
+    def test_load_local_refs(self):
+        self._git('branch', 'dev', self.commits[5])
+        self._git('tag', 'light', self.commits[3])
+        self._git('tag', '-a', '-m', 'release', 'v1.0', self.commits[4])
+        tag = self._git('rev-parse', 'v1.0')
+
+        ret, refs = self.project.load_local_refs()
+
+        self.assertEqual(0, ret)
+        self.assertEqual(self.commits[-1], refs['refs/heads/master'])
+        self.assertEqual(self.commits[5], refs['refs/heads/dev'])
+        self.assertEqual(self.commits[3], refs['refs/tags/light'])
+        # the annotated tag is recorded with its peeled commit
+        self.assertEqual(tag, refs['refs/tags/v1.0'])
+        self.assertEqual(self.commits[4], refs['refs/tags/v1.0^{}'])
+        self.assertEqual('refs/heads/master', self.project.local_head)
+
+    def test_resolve_rev(self):
+        self._git('tag', '-a', '-m', 'release', 'v1.0', self.commits[4])
+        self.project.load_local_refs()
+
+        # resolved with the loaded refs as "git rev-parse" does
+        for rev in ('master', 'heads/master', 'refs/heads/master', 'v1.0',
+                    'v1.0^{}', 'tags/v1.0^{}'):
+            self.assertEqual(
+                (0, self._git('rev-parse', rev)),
+                self.project.resolve_rev(rev), rev)
+
+        self.assertEqual((1, ''), self.project.resolve_rev('missing'))
+        self.assertFalse(self.project.rev_existed('refs/heads/missing'))
+
+        # the expressions are left to "git rev-parse"
+        self.assertEqual(
+            (0, self.commits[-3]), self.project.resolve_rev('master~2'))
+        self.assertEqual(
+            (0, self.commits[1]),
+            self.project.resolve_rev(self.commits[1][:12]))
+
+    def test_progressive_steps(self):
+        sha1, dest = self.commits[-1], 'refs/heads/master'
+
+        # every third commit is pushed before the head
+        self.project.remote_refs = dict()
+        self.assertEqual(
+            [self.commits[2], self.commits[5], self.commits[8]],
+            self.project._progressive_steps(  # pylint: disable=W0212
+                sha1, dest, 3, None))
+
+        # resumed from the head pushed
+        self.project.remote_refs = {dest: self.commits[4]}
+        self.assertEqual(
+            [self.commits[7]],
+            self.project._progressive_steps(  # pylint: disable=W0212
+                sha1, dest, 3, None))
+
+        # nothing to step with the head up to date
+        self.project.remote_refs = {dest: sha1}
+        self.assertEqual(
+            [], self.project._progressive_steps(  # pylint: disable=W0212
+                sha1, dest, 3, None))
+
+    def test_push_progressively(self):
+        # log the heads received by each push
+        log = os.path.join(self.tmpdir, 'received.log')
+        hook = os.path.join(self.remote, 'hooks', 'post-receive')
+        with open(hook, 'w') as fp:
+            fp.write('#!/bin/sh\ncut -d" " -f2 >> "%s"\n' % log)
+        os.chmod(hook, 0o755)
+
+        options = Values.build(extra=Values.build(progressive_commits='4'))
+        self.assertEqual(0, self.project.push_refspecs(
+            ['refs/heads/master:refs/heads/master'], options))
+
+        with open(log) as fp:
+            self.assertEqual(
+                [self.commits[3], self.commits[7], self.commits[-1]],
+                fp.read().split())
+        self.assertEqual(
+            {'refs/heads/master': self.commits[-1]}, self._remote_refs())
+        self.assertEqual(
+            self.commits[-1], self.project.remote_refs['refs/heads/master'])
+
+    def test_push_chunks(self):
+        for index in range(5):
+            self._git('branch', 'branch-%d' % index, self.commits[index])
+
+        self.project.load_local_refs()
+        self.project.get_remote_refs()
+        refspecs = ['refs/heads/branch-%d:refs/heads/branch-%d' % (
+            index, index) for index in range(5)]
+        options = Values.build(extra=Values.build(
+            chunk_size='2', chunk_jobs='2'))
+
+        self.assertEqual(0, self.project.push_refspecs(refspecs, options))
+
+        expected = dict(
+            ('refs/heads/branch-%d' % index, self.commits[index])
+            for index in range(5))
+        self.assertEqual(expected, self._remote_refs())
+        # the snapshot is updated with the pushed chunks
+        self.assertEqual(expected, self.project.remote_refs)
+
+    def test_push_chunks_failed(self):
+        self.project.load_local_refs()
+        self.project.get_remote_refs()
+        refspecs = ['refs/heads/master:refs/heads/master',
+                    'refs/heads/missing:refs/heads/missing',
+                    '%s:refs/heads/stable' % self.commits[2]]
+        options = Values.build(extra=Values.build(
+            chunk_size='1', chunk_jobs='3'))
+
+        self.assertEqual(1, self.project.push_refspecs(refspecs, options))
+        # the other chunks are pushed and the snapshot is dropped
+        self.assertEqual(
+            {'refs/heads/master': self.commits[-1],
+             'refs/heads/stable': self.commits[2]}, self._remote_refs())
+        self.assertIsNone(self.project.remote_refs)
+
+
+if __name__ == '__main__':
+    unittest.main()
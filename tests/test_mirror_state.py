@@ -0,0 +1,55 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from options import Values  # noqa: E402
+from topics import MirrorState  # noqa: E402
+
+
+class MirrorStateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='krep-test-')
+        self.state = MirrorState(
+            os.path.join(self.tmpdir, MirrorState.FILENAME))
+        self.refs = {'refs/heads/master': 'a' * 40, 'refs/tags/v1': 'b' * 40}
+
+    def tearDown(self):
+        self.state.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_extras(self):
+        options = Values.build(all=True, head_pattern='release/.*')
+        extras = MirrorState.extras(options, 'master')
+
+        self.assertEqual('master', extras[0])
+        self.assertEqual(len(MirrorState.PUSH_OPTIONS) + 1, len(extras))
+        self.assertIn(True, extras)
+        self.assertIn('release/.*', extras)
+
+    def test_unchanged_by_options(self):
+        extras = MirrorState.extras(Values.build(all=True), 'master')
+        self.state.save('project', 'remote', self.refs, *extras)
+
+        self.assertTrue(self.state.unchanged(
+            'project', 'remote', dict(self.refs), *extras))
+        self.assertEqual(self.refs, self.state.get_refs('project', 'remote'))
+
+        # any push option changes the fingerprint
+        for name in MirrorState.PUSH_OPTIONS:
+            options = Values.build(all=True)
+            setattr(options, name, 'changed')
+            self.assertFalse(self.state.unchanged(
+                'project', 'remote', self.refs,
+                *MirrorState.extras(options, 'master')), name)
+
+        refs = dict(self.refs, **{'refs/heads/dev': 'c' * 40})
+        self.assertFalse(self.state.unchanged(
+            'project', 'remote', refs, *extras))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from topics import CommandLoop, GitProject, SshPool  # noqa: E402
+from topics.gerrit_cmd import GerritCmd  # noqa: E402
+
+
+# the fake ssh logs the sessions and starts a "master" by creating the
+# control path, which is removed by "-O exit"
+FAKE_SSH = '''#!/bin/sh
+path=
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -o) case "$2" in ControlPath=*) path="${2#ControlPath=}";; esac
+        shift 2;;
+    -O) rm -f "$path"; exit 0;;
+    -p) shift 2;;
+    *) break;;
+  esac
+done
+if [ -n "$path" ] && [ ! -e "$path" ]; then
+  : > "$path"
+  echo "master $path $1" >> "%(log)s"
+else
+  echo "session $path $1" >> "%(log)s"
+fi
+shift
+case "$*" in
+  "gerrit ls-projects"*) echo "project-a"; echo "project-b";;
+  *) exit 1;;
+esac
+'''
+
+
+class SshPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='krep-test-')
+        self.log = os.path.join(self.tmpdir, 'ssh.log')
+
+        bindir = os.path.join(self.tmpdir, 'bin')
+        os.mkdir(bindir)
+        ssh = os.path.join(bindir, 'ssh')
+        with open(ssh, 'w') as fp:
+            fp.write(FAKE_SSH % {'log': self.log})
+        os.chmod(ssh, os.stat(ssh).st_mode | stat.S_IXUSR)
+
+        self.environ = dict(os.environ)
+        os.environ['PATH'] = os.pathsep.join(
+            [bindir, os.environ.get('PATH', '')])
+        os.environ.pop('GIT_SSH_COMMAND', None)
+        os.environ.pop('GIT_SSH', None)
+
+        self.pool = SshPool.POOL = SshPool(max_sessions=2)
+
+    def tearDown(self):
+        self.pool.close()
+        SshPool.POOL = None
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _read_log(self):
+        with open(self.log) as fp:
+            return [line.split() for line in fp]
+
+    def test_get_key(self):
+        self.assertEqual(
+            'review:29418', SshPool.get_key('ssh://user@review:29418/p'))
+        self.assertEqual('github.com:22', SshPool.get_key('git@github.com:p'))
+        self.assertIsNone(SshPool.get_key('https://review/p'))
+        self.assertIsNone(SshPool.get_key('/srv/git/p'))
+
+    def test_reuse_master(self):
+        gerrit = GerritCmd('review', True)
+        self.assertEqual(
+            set(['project-a', 'project-b']), gerrit.ls_projects())
+        gerrit.ls_projects(force=True)
+
+        (kind1, path1, host1), (kind2, path2, host2) = self._read_log()
+        self.assertEqual(('master', 'session'), (kind1, kind2))
+        self.assertEqual(path1, path2)
+        self.assertEqual(('review', 'review'), (host1, host2))
+        self.assertEqual([0], self.pool.counts('review:29418'))
+
+    def test_stream_holds_session(self):
+        gerrit = GerritCmd('review', True)
+        streams = [
+            gerrit._execute(  # pylint: disable=W0212
+                'ls-projects', capture_stdout=True, stream=True)
+            for _ in range(3)]
+
+        # the sessions are capped by max_sessions on each master
+        self.assertEqual([2, 1], self.pool.counts('review:29418'))
+        for stream in streams:
+            self.assertEqual(['project-a', 'project-b'], list(stream))
+
+        self.assertEqual([0, 0], self.pool.counts('review:29418'))
+        self.assertEqual(2, len(set(line[1] for line in self._read_log())))
+
+    def test_sessions_by_host(self):
+        first = GerritCmd('review', True)
+        second = GerritCmd('user@mirror', True)
+        streams = [
+            gerrit._execute(  # pylint: disable=W0212
+                'ls-projects', capture_stdout=True, stream=True)
+            for gerrit in (first, first, second)]
+
+        self.assertEqual([2], self.pool.counts('review:29418'))
+        self.assertEqual([1], self.pool.counts('mirror:29418'))
+        for stream in streams:
+            list(stream)
+
+    @unittest.skipUnless(CommandLoop.available(), 'asyncio is missing')
+    def test_loop_releases_on_callback(self):
+        gerrit = GerritCmd('review', True)
+        results = list()
+        loop = CommandLoop(jobs=4)
+        for _ in range(3):
+            gerrit._execute(  # pylint: disable=W0212
+                'ls-projects', capture_stdout=True, loop=loop,
+                callback=lambda ret, out: results.append(ret))
+
+        self.assertEqual([2, 1], self.pool.counts('review:29418'))
+        self.assertTrue(loop.run())
+        self.assertEqual([0, 0, 0], results)
+        self.assertEqual([0, 0], self.pool.counts('review:29418'))
+
+    def test_git_ssh_command_per_call(self):
+        project = GitProject(
+            'project', worktree=self.tmpdir, gitdir=self.tmpdir)
+        project.ls_remote('ssh://review:29418/project')
+
+        self.assertNotIn('GIT_SSH_COMMAND', project.env)
+        (kind, path, host), = self._read_log()
+        self.assertEqual(('master', 'review'), (kind, host))
+        self.assertTrue(path.startswith(self.pool.directory))
+        self.assertEqual([0], self.pool.counts('review:29418'))
+
+    def test_git_ssh_command_configured(self):
+        wrapper = os.path.join(self.tmpdir, 'bin', 'ssh-wrapper')
+        with open(wrapper, 'w') as fp:
+            fp.write('#!/bin/sh\necho wrapper >> "%s"\nexec ssh "$@"\n'
+                     % self.log)
+        os.chmod(wrapper, os.stat(wrapper).st_mode | stat.S_IXUSR)
+
+        gitdir = os.path.join(self.tmpdir, 'project.git')
+        subprocess.check_call(['git', 'init', '-q', '--bare', gitdir])
+        for name, value in (('core.sshCommand', wrapper),
+                            # no probe of the variant with "-G"
+                            ('ssh.variant', 'ssh')):
+            subprocess.check_call(
+                ['git', '--git-dir', gitdir, 'config', name, value])
+
+        project = GitProject('project', gitdir=gitdir, bare=True)
+        project.ls_remote('ssh://review:29418/project')
+
+        (wrapped,), (kind, _, host) = self._read_log()
+        self.assertEqual(('wrapper', 'master', 'review'),
+                         (wrapped, kind, host))
+
+    def test_git_ssh_not_multiplexed(self):
+        os.environ['GIT_SSH'] = os.path.join(self.tmpdir, 'bin', 'ssh')
+
+        project = GitProject(
+            'project', worktree=self.tmpdir, gitdir=self.tmpdir)
+        project.ls_remote('ssh://review:29418/project')
+
+        # no session of the pool is taken
+        self.assertEqual([['session', 'review']], self._read_log())
+        self.assertEqual([], self.pool.counts('review:29418'))
+
+
+if __name__ == '__main__':
+    unittest.main()
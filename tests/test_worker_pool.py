@@ -0,0 +1,180 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from topics import JobTokens, WorkerPool  # noqa: E402
+
+# the deadline of the task is kept by the command module used by the pool
+Command = sys.modules[WorkerPool.__module__].Command
+CommandTimeoutError = sys.modules[WorkerPool.__module__].CommandTimeoutError
+
+
+def _run(*args):
+    command = Command()
+    command.new_args(list(args))
+
+    return command.dispatch()
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def tearDown(self):
+        JobTokens.TOKENS = None
+
+    def test_run_in_order(self):
+        with WorkerPool(4) as pool:
+            results = pool.run(list(range(10)), lambda task: task * 2 + 1)
+
+        self.assertEqual(list(range(10)), [r.task for r in results])
+        self.assertEqual(
+            [task * 2 + 1 for task in range(10)], [r.value for r in results])
+        self.assertTrue(all(r.succeeded() for r in results))
+
+    def test_inline_raise(self):
+        def _func(task):
+            if task == 1:
+                raise ValueError('task %d' % task)
+
+            return True
+
+        with WorkerPool(1) as pool:
+            self.assertRaises(ValueError, pool.run, [0, 1, 2], _func)
+
+        # the failure is recorded and the others go on with keep_going
+        with WorkerPool(1, keep_going=True) as pool:
+            results = pool.run([0, 1, 2], _func)
+
+        self.assertEqual([True, False, True], [r.succeeded() for r in results])
+        self.assertIsInstance(results[1].exception, ValueError)
+        self.assertEqual('task 1', results[1].reason())
+
+    def test_abort_without_keep_going(self):
+        def _func(task):
+            if task == 0:
+                raise ValueError('failed')
+
+            time.sleep(0.01)
+            return True
+
+        with WorkerPool(2) as pool:
+            results = pool.run(list(range(20)), _func)
+            self.assertTrue(pool.is_aborted())
+
+        self.assertIsInstance(results[0].exception, ValueError)
+        self.assertTrue(any(r.skipped for r in results))
+        self.assertEqual(
+            set(['skipped']),
+            set(r.reason() for r in results if r.skipped))
+
+    def test_keep_going(self):
+        def _func(task):
+            if task % 3 == 0:
+                raise ValueError('failed')
+
+            return True
+
+        with WorkerPool(3, keep_going=True) as pool:
+            results = pool.run(list(range(9)), _func)
+            self.assertFalse(pool.is_aborted())
+
+        self.assertEqual(
+            [0, 3, 6], [r.task for r in results if not r.succeeded()])
+        self.assertFalse(any(r.skipped for r in results))
+
+    def test_retry_transient(self):
+        attempts = list()
+
+        def _func(task):
+            attempts.append(task)
+            if len(attempts) < 3:
+                # fails with a transient error of the network
+                return _run(
+                    'sh', '-c', 'echo Connection reset >&2; exit 1') == 0
+
+            return True
+
+        with WorkerPool(2, retries=2, backoff=0.01) as pool:
+            results = pool.run(['project'], _func)
+
+        self.assertEqual(['project'] * 3, attempts)
+        self.assertTrue(results[0].succeeded())
+        self.assertEqual(3, results[0].attempts)
+
+    def test_no_retry_permanent(self):
+        def _func(_):
+            return _run('sh', '-c', 'echo denied >&2; exit 1') == 0
+
+        with WorkerPool(2, retries=2, backoff=0.01) as pool:
+            results = pool.run(['project'], _func)
+
+        self.assertFalse(results[0].succeeded())
+        self.assertFalse(results[0].transient)
+        self.assertEqual(1, results[0].attempts)
+
+    def test_timeout(self):
+        def _func(task):
+            return _run('sleep', '5' if task == 'slow' else '0') == 0
+
+        start = time.time()
+        with WorkerPool(2, timeout=0.5) as pool:
+            results = pool.run(['slow', 'fast'], _func)
+
+        self.assertLess(time.time() - start, 4)
+        self.assertTrue(results[0].timedout)
+        self.assertIsInstance(results[0].exception, CommandTimeoutError)
+        self.assertEqual('timed out', results[0].reason())
+        # a timed-out task doesn't abort the others
+        self.assertTrue(results[1].succeeded())
+
+    def test_retry_timeout(self):
+        attempts = list()
+
+        def _func(task):
+            attempts.append(task)
+            # times out at the first attempt only
+            return _run('sleep', '5' if len(attempts) == 1 else '0') == 0
+
+        with WorkerPool(2, timeout=0.5, retries=1, backoff=0.01) as pool:
+            results = pool.run(['project'], _func)
+
+        self.assertEqual(2, results[0].attempts)
+        self.assertTrue(results[0].succeeded())
+
+    def test_tokens(self):
+        # the first worker runs with the inherited token only
+        JobTokens.TOKENS = JobTokens(2)
+        lock = threading.Lock()
+        running, peaks = [0], [0]
+
+        def _func(_):
+            with lock:
+                running[0] += 1
+                peaks[0] = max(peaks[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+
+            return True
+
+        with WorkerPool(4) as pool:
+            results = pool.run(list(range(12)), _func)
+
+        self.assertTrue(all(r.succeeded() for r in results))
+        self.assertEqual(2, peaks[0])
+
+        # or takes a token as well without inheriting
+        peaks[0] = 0
+        JobTokens.TOKENS = JobTokens(3)
+        with WorkerPool(4, inherit=False) as pool:
+            pool.run(list(range(12)), _func)
+
+        self.assertEqual(2, peaks[0])
+        # all tokens are returned
+        self.assertEqual(2, JobTokens.TOKENS.acquire_many(4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,15 @@
 
+import contextlib
 import os
+import re
+import signal
 import subprocess
+import sys
+import tempfile
+import threading
+import time
 
+from dir_utils import absolute_path, get_base_dir
 from error import KrepError
 from logger import Logger
 
@@ -10,14 +18,138 @@ class CommandNotDetectedError(KrepError):
     """Indicate the sub-command of a command cannot be found."""
 
 
+class CommandTimeoutError(KrepError):
+    """Indicate the command is killed as the deadline of the task passed."""
+
+
+# the deadline and the failures of the task run by the thread
+_task = threading.local()  # pylint: disable=C0103
+
+
+class CommandGovernor(object):
+    """Limits the child processes running at the same time in the whole
+    process.
+
+    Each command takes a slot of its class before it's started, "fetch"
+    for the commands downloading from the remote, "push", "ssh" for the
+    gerrit commands and "local" for the others. The slots are limited in
+    total by "limit" and for each class by "limits". A command started by
+    a thread already holding a slot isn't blocked not to deadlock."""
+
+    CLASSES = ('fetch', 'push', 'ssh', 'local')
+    GOVERNOR = None
+
+    def __init__(self, limit=0, limits=None):
+        self.limit = limit if limit and limit > 0 else 0
+        self.limits = limits or dict()
+        self.cond = threading.Condition()
+        self.running = dict((name, 0) for name in CommandGovernor.CLASSES)
+        self.peaks = dict(self.running, total=0)
+        self.local = threading.local()
+
+    @staticmethod
+    def build(options):
+        if CommandGovernor.GOVERNOR is None and (
+                options.max_processes or options.process_limit):
+            limits = dict()
+            for item in options.process_limit or list():
+                name, _, value = item.partition('=')
+                if name not in CommandGovernor.CLASSES or \
+                        not value.isdigit():
+                    raise KrepError(
+                        'invalid process limit "%s", expect CLASS=NUM with '
+                        'CLASS in %s' % (
+                            item, ', '.join(CommandGovernor.CLASSES)))
+
+                limits[name] = int(value)
+
+            CommandGovernor.GOVERNOR = CommandGovernor(
+                options.max_processes, limits)
+
+        return CommandGovernor.GOVERNOR
+
+    @staticmethod
+    def get():
+        return CommandGovernor.GOVERNOR
+
+    def _available(self, name, slots):
+        # a command larger than the limit runs alone
+        total = sum(self.running.values())
+        if self.limit and total and total + slots > self.limit:
+            return False
+
+        limit = self.limits.get(name)
+        running = self.running[name]
+        if limit and running and running + slots > limit:
+            return False
+
+        return True
+
+    def acquire(self, name='local', slots=1):
+        """Takes "slots" slots of the class and returns the handle to
+        release them."""
+        if name not in self.running:
+            name = 'local'
+
+        held = getattr(self.local, 'held', 0)
+        with self.cond:
+            while held == 0 and not self._available(name, slots):
+                # wake up in time to handle the interruption
+                self.cond.wait(1)
+
+            self.running[name] += slots
+            self.peaks[name] = max(self.peaks[name], self.running[name])
+            self.peaks['total'] = max(
+                self.peaks['total'], sum(self.running.values()))
+
+        self.local.held = held + 1
+
+        return name, slots
+
+    def release(self, handle):
+        name, slots = handle
+        self.local.held = max(getattr(self.local, 'held', 1) - 1, 0)
+        with self.cond:
+            self.running[name] -= slots
+            self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, name='local', slots=1):
+        """Holds the slots of the class while a command is running."""
+        handle = self.acquire(name, slots)
+        try:
+            yield
+        finally:
+            self.release(handle)
+
+    def counts(self):
+        """Returns the running processes of each class and the total."""
+        with self.cond:
+            return dict(self.running, total=sum(self.running.values()))
+
+    def get_peaks(self):
+        with self.cond:
+            return dict(self.peaks)
+
+
 class Command(object):  # pylint: disable=R0902
     """Executes a local executable command."""
+    # the failures of the network which may pass with a retry
+    TRANSIENT_ERRORS = re.compile(
+        r'(Connection (reset|refused|timed out|closed)|early EOF|'
+        r'remote end hung up|RPC failed|Could not resolve host|'
+        r'Temporary failure in name resolution|kex_exchange_identification|'
+        r'ssh_exchange_identification|Broken pipe|'
+        r'HTTP (code|status) 50[234]|The requested URL returned error: 50)',
+        re.IGNORECASE)
+
     def __init__(self, cwd=None, provide_stdin=False,  # pylint: disable=R0913
                  capture_stdout=False, capture_stderr=True,
                  environ=None, dryrun=False, *args, **kws):
         self.cwd = cwd
         self.stdout = ''
         self.stderr = ''
+        self.returncode = None
         self.env = os.environ.copy()
         if environ:
             self.env.update(environ)
@@ -65,16 +197,26 @@ class Command(object):  # pylint: disable=R0902
     def set_env(self, environ):
         self.env.update(environ)
 
-    def wait(self, **kws):
-        if not kws and self.kws:
-            kws = self.kws
+    def get_env(self, kws=None):
+        """Returns the environment of the call, which is updated with the
+        keyword "environ" without changing the command."""
+        if not kws or not kws.get('environ'):
+            return self.env
 
+        env = dict(self.env)
+        env.update(kws['environ'])
+
+        return env
+
+    def _prepare(self, kws):
         cli = list()
         cli.extend([str(a) for a in self.args])
 
-        cwd = kws.get('cwd', self.cwd or os.getcwd())
+        # run in the base directory of the thread instead of changing the
+        # current directory of the process
+        cwd = absolute_path(kws.get('cwd', self.cwd) or get_base_dir())
         if not os.path.exists(cwd):
-            cwd = os.getcwd()
+            cwd = get_base_dir()
         dryrun = kws.get('dryrun', self.dryrun)
         # the config for the std device may be duplicated
         provide_stdin = kws.get('provide_stdin', self.provide_stdin)
@@ -97,22 +239,224 @@ class Command(object):  # pylint: disable=R0902
         if dryrun:
             cli = ['true']
 
-        proc = subprocess.Popen(
-            cli, cwd=cwd,
-            env=self.env,
-            stdin=subprocess.PIPE if provide_stdin else None,
-            stdout=subprocess.PIPE if capture_stdout else None,
-            stderr=subprocess.PIPE if capture_stderr else None)
+        return cli, cwd, provide_stdin, capture_stdout, capture_stderr
+
+    @staticmethod
+    def begin_task(timeout=None):
+        """Starts a task of the thread, whose commands are killed with their
+        process groups once "timeout" seconds passed. The returned state is
+        restored by end_task() so that the tasks can be nested."""
+        previous = (getattr(_task, 'deadline', None),
+                    getattr(_task, 'transient', False))
+
+        deadline = time.time() + timeout if timeout else None
+        if previous[0] is not None:
+            deadline = min(deadline or previous[0], previous[0])
+
+        _task.deadline = deadline
+        _task.transient = False
+
+        return previous
+
+    @staticmethod
+    def end_task(previous=(None, False)):
+        """Ends the task and returns true if any of its commands failed with
+        a transient error of the network."""
+        transient = getattr(_task, 'transient', False)
+        _task.deadline = previous[0]
+        _task.transient = previous[1] or transient
+
+        return transient
 
-        self.stdout, self.stderr = proc.communicate()
+    @staticmethod
+    def _get_timeout():
+        deadline = getattr(_task, 'deadline', None)
+        if deadline is None:
+            return None
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise CommandTimeoutError('the deadline of the task passed')
+
+        return remaining
+
+    @staticmethod
+    def _popen(cli, timeout, **kws):
+        # run in a new process group to kill the children of the command,
+        # like ssh started by git, once the task times out
+        if timeout is not None and hasattr(os, 'setsid'):
+            if sys.version_info[0] < 3:
+                kws['preexec_fn'] = os.setsid
+            else:
+                # preexec_fn isn't safe with the threads running
+                kws['start_new_session'] = True
+
+        return subprocess.Popen(cli, **kws)
+
+    def _watch(self, proc, timeout):
+        """Returns a started timer which kills the process group of "proc"
+        after "timeout" seconds, or None without the timeout."""
+        if timeout is None:
+            return None
+
+        def _kill():
+            timer.killed = True
+            Logger.get_logger().error(
+                'timeout: kill "%s" after %.1fs', ' '.join(
+                    [str(arg) for arg in self.args]), timeout)
+            try:
+                if hasattr(os, 'killpg'):
+                    os.killpg(proc.pid, signal.SIGKILL)
+                else:
+                    proc.kill()
+            except OSError:
+                pass
+
+        timer = threading.Timer(timeout, _kill)
+        timer.killed = False
+        timer.daemon = True
+        timer.start()
+
+        return timer
+
+    def _unwatch(self, timer):
+        if timer is None:
+            return
+
+        timer.cancel()
+        timer.join()
+        if timer.killed:
+            _task.transient = True
+            raise CommandTimeoutError(
+                'killed "%s" as the task timed out' % ' '.join(
+                    [str(arg) for arg in self.args]))
+
+    def _acquire(self, kws):
+        """Takes the slot of the command from the governor if it's built,
+        the class and the number of the slots are set with the keywords
+        "command_class" and "slots". No slot is taken with zero "slots"."""
+        governor = CommandGovernor.get()
+        if governor is None or kws.get('dryrun', self.dryrun) \
+                or kws.get('slots') == 0:
+            return None
+
+        return governor.acquire(
+            kws.get('command_class') or 'local', kws.get('slots') or 1)
+
+    @staticmethod
+    def _release(handle):
+        if handle is not None:
+            CommandGovernor.get().release(handle)
+
+    def _report(self, returncode):
+        logger = Logger.get_logger()
+
+        self.returncode = returncode
+        if returncode and self.stderr and \
+                Command.TRANSIENT_ERRORS.search(self.get_error()):
+            _task.transient = True
         if self.stderr:
-            if proc.returncode:
+            if returncode:
                 logger.error('exec: %s', self.get_error())
             else:
                 logger.info('stderr: %s', self.get_error())
 
+    def wait(self, **kws):
+        if not kws and self.kws:
+            kws = self.kws
+
+        cli, cwd, provide_stdin, capture_stdout, capture_stderr = \
+            self._prepare(kws)
+
+        handle = self._acquire(kws)
+        try:
+            timeout = Command._get_timeout()
+            proc = Command._popen(
+                cli, timeout, cwd=cwd,
+                env=self.get_env(kws),
+                stdin=subprocess.PIPE if provide_stdin else None,
+                stdout=subprocess.PIPE if capture_stdout else None,
+                stderr=subprocess.PIPE if capture_stderr else None)
+
+            timer = self._watch(proc, timeout)
+            try:
+                self.stdout, self.stderr = proc.communicate()
+            finally:
+                self._report(proc.returncode)
+                self._unwatch(timer)
+        finally:
+            Command._release(handle)
+
         return proc.returncode
 
+    def stream(self, **kws):
+        """Runs the command and returns an iterator of the decoded output
+        lines, which are read while the process is still running.
+
+        The return code is set to "returncode" after the last line is read.
+        """
+        if not kws and self.kws:
+            kws = self.kws
+
+        cli, cwd, provide_stdin, _, capture_stderr = self._prepare(kws)
+
+        # stderr goes to a temporary file not to block the child with a
+        # full pipe which wouldn't be read until stdout is exhausted
+        errfp = tempfile.TemporaryFile() if capture_stderr else None
+        # the slot is held until the last line is read
+        handle = self._acquire(kws)
+        try:
+            timeout = Command._get_timeout()
+            proc = Command._popen(
+                cli, timeout, cwd=cwd,
+                env=self.get_env(kws),
+                stdin=subprocess.PIPE if provide_stdin else None,
+                stdout=subprocess.PIPE,
+                stderr=errfp)
+        except:  # pylint: disable=W0702
+            Command._release(handle)
+            raise
+
+        if provide_stdin:
+            proc.stdin.close()
+
+        self.stdout, self.stderr = '', ''
+        self.returncode = None
+
+        return self._read_lines(
+            proc, errfp, self._watch(proc, timeout), handle)
+
+    def _read_lines(self, proc, errfp, timer=None, handle=None):
+        try:
+            for line in iter(proc.stdout.readline, b''):
+                yield str(line.decode('utf-8')).rstrip('\r\n')
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+            if errfp:
+                errfp.seek(0)
+                self.stderr = errfp.read()
+                errfp.close()
+
+            try:
+                self._report(returncode)
+                self._unwatch(timer)
+            finally:
+                Command._release(handle)
+
+    def dispatch(self, **kws):
+        """Runs the command in the mode decided by the keywords.
+
+        With "loop" the command is submitted to the CommandLoop and the
+        handle is returned, "stream" returns the line iterator. Otherwise
+        the command runs and the return code is returned."""
+        if kws.get('loop') is not None:
+            return kws['loop'].submit(self, **kws)
+        elif kws.get('stream'):
+            return self.stream(**kws)
+        else:
+            return self.wait(**kws)
+
     @staticmethod
     def normalize(command):
         return command.replace('_', '-')
@@ -132,4 +476,5 @@ class Command(object):  # pylint: disable=R0902
         else:
             return ''
 
-TOPIC_ENTRY = "Command, CommandNotDetectedError"
+TOPIC_ENTRY = "Command, CommandGovernor, CommandNotDetectedError, " \
+    "CommandTimeoutError"
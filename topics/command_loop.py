@@ -0,0 +1,177 @@
+import collections
+import subprocess
+import sys
+import threading
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None  # pylint: disable=C0103
+
+from error import KrepError
+from logger import Logger
+
+
+class CommandLoopError(KrepError):
+    """Indicate the asyncio event loop cannot be used."""
+
+
+class _CommandProtocol(asyncio.SubprocessProtocol if asyncio else object):
+    def __init__(self, done):
+        self.done = done
+        self.transport = None
+        self.stdout = list()
+        self.stderr = list()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def pipe_data_received(self, fd, data):
+        if fd == 1:
+            self.stdout.append(data)
+        else:
+            self.stderr.append(data)
+
+    def process_exited(self):
+        pass
+
+    def connection_lost(self, exc):  # pylint: disable=W0613
+        # invoked once the process exited and all pipes are closed
+        returncode = self.transport.get_returncode()
+        self.transport.close()
+
+        self.done(returncode, b''.join(self.stdout), b''.join(self.stderr))
+
+
+class CommandLoop(object):
+    """Runs commands as child processes on a single asyncio event loop.
+
+    Commands are submitted with the keyword "loop" instead of running at
+    once, and the optional "callback" is invoked in the loop with the return
+    code and the captured output after the command exits:
+
+      loop = CommandLoop(jobs=64)
+      project.raw_command(
+          'ls-remote', '--heads', url, notdir=True, capture_stdout=True,
+          loop=loop, callback=handler)
+      loop.run()
+
+    The callback can submit the following commands to build a chain. No more
+    than "jobs" processes are alive at the same time."""
+
+    def __init__(self, jobs=None):
+        if asyncio is None:
+            raise CommandLoopError('asyncio is not supported by the Python')
+
+        self.jobs = jobs if jobs and jobs > 0 else 1
+        self.pending = collections.deque()
+        self.running = 0
+        self.failed = 0
+        self.loop = None
+        self.finished = None
+
+    @staticmethod
+    def _need_watcher():
+        # the child watcher of Python 3.7 and before waits for SIGCHLD with
+        # the loop attached, which can be done in the main thread only
+        return sys.version_info < (3, 8)
+
+    @staticmethod
+    def available():
+        if asyncio is None:
+            return False
+
+        return not CommandLoop._need_watcher() or \
+            threading.current_thread() is threading.main_thread()
+
+    def submit(self, command, **kws):
+        cli, cwd, provide_stdin, capture_stdout, capture_stderr = \
+            command._prepare(kws)  # pylint: disable=W0212
+
+        self.pending.append((
+            cli, cwd, dict(command.get_env(kws)), provide_stdin,
+            capture_stdout, capture_stderr, kws.get('callback')))
+        if self.loop is not None:
+            self._start()
+
+    def _start(self):
+        while self.pending and self.running < self.jobs:
+            entry = self.pending.popleft()
+            cli, cwd, env, provide_stdin, capture_stdout, capture_stderr, _ = \
+                entry
+
+            self.running += 1
+            protocol = _CommandProtocol(
+                lambda ret, out, err, entry=entry: self._done(
+                    entry, ret, out, err))
+            task = self.loop.create_task(
+                self.loop.subprocess_exec(
+                    lambda protocol=protocol: protocol, *cli,
+                    cwd=cwd, env=env,
+                    stdin=subprocess.DEVNULL if provide_stdin else None,
+                    stdout=subprocess.PIPE if capture_stdout else None,
+                    stderr=subprocess.PIPE if capture_stderr else None))
+            task.add_done_callback(
+                lambda task, entry=entry: self._started(entry, task))
+
+    def _started(self, entry, task):
+        if not task.cancelled() and task.exception() is not None:
+            self._done(entry, 255, b'', str(task.exception()).encode('utf-8'))
+
+    def _done(self, entry, returncode, stdout, stderr):
+        logger = Logger.get_logger()
+
+        self.running -= 1
+        if returncode:
+            self.failed += 1
+
+        if stderr:
+            if returncode:
+                logger.error('exec: %s', stderr.decode('utf-8').strip())
+            else:
+                logger.info('stderr: %s', stderr.decode('utf-8').strip())
+
+        callback = entry[-1]
+        if callback:
+            try:
+                callback(
+                    returncode,
+                    str(stdout.decode('utf-8')).strip() if stdout else '')
+            except Exception as e:  # pylint: disable=W0703
+                logger.exception(e)
+                self.failed += 1
+
+        self._start()
+        if not self.pending and self.running == 0 \
+                and not self.finished.done():
+            self.finished.set_result(True)
+
+    def run(self):
+        """Runs until all submitted commands exit, returns False if any of
+        them failed."""
+        if not CommandLoop.available():
+            raise CommandLoopError(
+                'the child processes can be watched in the main thread only')
+
+        self.failed = 0
+        self.loop = asyncio.new_event_loop()
+        watcher = None
+        try:
+            if CommandLoop._need_watcher():
+                watcher = asyncio.get_child_watcher()
+                watcher.attach_loop(self.loop)
+
+            self.finished = asyncio.Future(loop=self.loop)
+            if self.pending:
+                self.loop.call_soon(self._start)
+                self.loop.run_until_complete(self.finished)
+        finally:
+            if watcher is not None:
+                watcher.attach_loop(None)
+            self.loop.close()
+            self.loop = None
+
+        return self.failed == 0
+
+
+TOPIC_ENTRY = 'CommandLoop, CommandLoopError'
@@ -0,0 +1,156 @@
+import collections
+import json
+import socket
+import sys
+import threading
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+from command import Command
+from files.file_utils import FileUtils
+from logger import Logger
+
+
+class RefUpdate(collections.namedtuple(
+        'RefUpdate', ('project', 'ref', 'old', 'new'))):
+    """Records the "refUpdate" of a "ref-updated" event."""
+
+    NULL_SHA1 = '0' * 40
+
+    def deleted(self):
+        return self.new == RefUpdate.NULL_SHA1
+
+
+class EventStream(object):
+    """Reads the JSON lines of "gerrit stream-events" and yields the ref
+    updates.
+
+    The source can be a file ("-" for stdin), "tcp://HOST:PORT" for a socket
+    sending the lines, or "ssh://[USER@]HOST[:PORT]" to run the gerrit
+    command. The connection of a socket or ssh is restarted after
+    "retry_interval" seconds once it's lost, a file is read once."""
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--refs') or \
+            optparse.add_option_group('Remote options')
+        options.add_option(
+            '--stream-events',
+            dest='stream_events', action='store', metavar='SOURCE',
+            help='Mirror the projects and refs in the "ref-updated" events '
+                 'of "gerrit stream-events" read from the source, which is '
+                 'a file, "tcp://HOST:PORT" or "ssh://HOST:PORT"')
+
+    def __init__(self, source, retry_interval=10):
+        self.source = source
+        self.retry_interval = retry_interval
+        self.closed = threading.Event()
+
+        ulp = urlparse(source)
+        self.scheme = ulp.scheme if ulp.scheme in ('tcp', 'ssh') else None
+        self.host = ulp.hostname
+        self.port = ulp.port
+        self.user = ulp.username
+
+    def is_file(self):
+        return self.scheme is None
+
+    def _read_file(self):
+        if self.source == '-':
+            for line in iter(sys.stdin.readline, ''):
+                yield line
+        else:
+            with open(FileUtils.absolute_path(self.source), 'r') as fp:
+                for line in fp:
+                    yield line
+
+    def _read_socket(self):
+        sock = socket.create_connection((self.host, self.port))
+        try:
+            fp = sock.makefile('rb')
+            for line in iter(fp.readline, b''):
+                yield line.decode('utf-8')
+        finally:
+            sock.close()
+
+    def _read_ssh(self):
+        command = Command()
+        cli = [FileUtils.find_execute('ssh'), '-p', str(self.port or 29418)]
+        cli.append('%s@%s' % (self.user, self.host) if self.user
+                   else self.host)
+        cli.extend(['gerrit', 'stream-events', '-s', 'ref-updated'])
+        command.new_args(cli)
+
+        # the endless stream isn't counted by the governor of the processes
+        for line in command.stream(slots=0):
+            yield line
+
+    def _lines(self):
+        if self.scheme == 'tcp':
+            return self._read_socket()
+        elif self.scheme == 'ssh':
+            return self._read_ssh()
+        else:
+            return self._read_file()
+
+    @staticmethod
+    def parse(line):
+        """Returns the RefUpdate of a "ref-updated" event line, or None."""
+        line = line.strip()
+        if not line:
+            return None
+
+        try:
+            event = json.loads(line)
+        except ValueError:
+            Logger.get_logger().debug('malformed event: %s', line)
+            return None
+
+        if not isinstance(event, dict) or event.get('type') != 'ref-updated':
+            return None
+
+        update = event.get('refUpdate') or dict()
+        ref = update.get('refName') or ''
+        # the old gerrit sends the short name of the branch
+        if ref and not ref.startswith('refs/'):
+            ref = 'refs/heads/%s' % ref
+
+        if not update.get('project') or not ref:
+            return None
+
+        return RefUpdate(
+            update['project'], ref, update.get('oldRev'),
+            update.get('newRev'))
+
+    def updates(self):
+        """Yields the RefUpdate until the stream ends or is closed."""
+        logger = Logger.get_logger()
+
+        while not self.closed.is_set():
+            try:
+                for line in self._lines():
+                    if self.closed.is_set():
+                        return
+
+                    update = EventStream.parse(line)
+                    if update is not None:
+                        yield update
+            except (IOError, OSError, socket.error) as e:
+                logger.error('%s: %s', self.source, e)
+
+            if self.is_file():
+                return
+
+            logger.warning(
+                '%s: stream lost, reconnect in %ds', self.source,
+                self.retry_interval)
+            self.closed.wait(self.retry_interval)
+
+    def close(self):
+        self.closed.set()
+
+
+TOPIC_ENTRY = 'EventStream, RefUpdate'
@@ -4,7 +4,7 @@ import re
 import tempfile
 import shutil
 
-from dir_utils import AutoChangedDir
+from dir_utils import absolute_path, get_base_dir
 from topics.command import Command
 from topics.error import KrepError
 
@@ -27,7 +27,7 @@ class FileDecompressor(Command):
         ('.xz', ('xz', '--keep')),
     )
 
-    def execute(self, filename):
+    def execute(self, filename, cwd=None):
         args = list()
         for items in FileDecompressor.COMMAND_FOR_EXTENSION:
             if len(items) == 2:
@@ -51,14 +51,16 @@ class FileDecompressor(Command):
                     filename, (os.path.split(filename))[1]))
 
         self.new_args(args)  # pylint: disable=E1101
-        return self.wait()
+        return self.wait(cwd=cwd)
 
     @staticmethod
     def extract(filename, output):
-        decompressor = FileDecompressor()
+        output = FileUtils.absolute_path(output)
+        if not os.path.exists(output):
+            os.makedirs(output)
 
-        with AutoChangedDir(output, cleanup=False):
-            decompressor.execute(filename)
+        decompressor = FileDecompressor()
+        decompressor.execute(FileUtils.absolute_path(filename), cwd=output)
 
 
 class FileVersion(object):
@@ -109,6 +111,17 @@ class FileUtils(object):
 
         return None
 
+    @staticmethod
+    def get_base_dir():
+        """Returns the base directory of the current thread, which takes
+        the place of the current directory."""
+        return get_base_dir()
+
+    @staticmethod
+    def absolute_path(path, base=None):
+        """Returns the path resolved with "base" or the base directory."""
+        return absolute_path(path, base)
+
     @staticmethod
     def secure_path(dirname):
         if dirname:
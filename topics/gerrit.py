@@ -1,13 +1,15 @@
 
 from gerrit_cmd import GerritCmd, GerritError
+from gerrit_rest import GerritRest
 
 
 class Gerrit(GerritCmd):
     """\
 Provides Gerrit access.
 
-It encapsulates the ssh command to run Gerrit commands. Not all but
-required commands have been implemented with specific handling:
+It encapsulates the ssh command to run Gerrit commands, or the REST API
+with the option "--gerrit-rest-url". Not all but required commands have
+been implemented with specific handling:
 
  - create-branch
  - create-project
@@ -49,9 +51,30 @@ implicitly."""
             help='Set the repository description in gerrit when creating the '
                  'new repository. If not set, the default string will be '
                  'used. "--no-description" could suppress the description')
+        options.add_option(
+            '--gerrit-prefix',
+            dest='gerrit_prefix', action='append', metavar='PREFIX',
+            help='List the gerrit projects with the prefix instead of all '
+                 'projects on the server. The project out of the prefixes '
+                 'will be queried by itself')
+        options.add_option(
+            '--gerrit-rest-url',
+            dest='gerrit_rest_url', action='store', metavar='URL',
+            help='Access gerrit with the REST API of the url instead of the '
+                 'ssh commands. The credentials are read from the url or '
+                 'the netrc file')
+        options.add_option(
+            '--gerrit-heads-inventory',
+            dest='gerrit_heads_inventory', action='store_true',
+            help='List the heads of the pushed branches of all projects with '
+                 'a single ls-projects instead of ls-remote per project')
 
     def __init__(self, server, options=None):
-        GerritCmd.__init__(self, server, options and options.gerrit)
+        GerritCmd.__init__(
+            self, server, options and options.gerrit,
+            options and options.gerrit_prefix,
+            options and options.gerrit_rest_url
+            and GerritRest(options.gerrit_rest_url))
 
     def has_project(self, project):
         return self.has_project_(project)
@@ -1,8 +1,12 @@
 
+import json
+import threading
+
 from command import Command
 from files.file_utils import FileUtils
 from logger import Logger
-from synchronize import synchronized
+from ssh_pool import SshPool
+from worker_pool import WorkerPool
 
 
 class GerritError(Exception):
@@ -10,25 +14,57 @@ class GerritError(Exception):
 
 
 class GerritCmd(Command):
-    def __init__(self, server, enable):
+    # the locks of the servers shared by the instances
+    LOCKS = dict()
+    LOCK = threading.Lock()
+
+    def __init__(self, server, enable, prefixes=None, rest=None):
         Command.__init__(self)
 
         self.dirty = True
         self.enable = enable
         self.server = server
 
-        self.projects = list()
+        # the prefixes to list the projects, the empty one for all projects
+        self.prefixes = prefixes or ['']
+        # the prefixes listed and the projects under them
+        self.listed = set()
+        self.projects = set()
+        # GerritInventory to keep the projects across the runs
+        self.inventory = None
+        # GerritRest to access the REST API instead of the ssh commands
+        self.rest = rest
+        self.lock = GerritCmd.get_lock(server)
         self.ssh = FileUtils.find_execute('ssh')
 
+    @staticmethod
+    def get_lock(server):
+        with GerritCmd.LOCK:
+            if server not in GerritCmd.LOCKS:
+                GerritCmd.LOCKS[server] = threading.RLock()
+
+            return GerritCmd.LOCKS[server]
+
     def set_dirty(self, dirty):
         self.dirty = dirty
+        if dirty:
+            self.listed = set()
+
+    def set_inventory(self, inventory):
+        self.inventory = inventory
+        if inventory is not None:
+            entry = inventory.get(self.server)
+            if entry:
+                self.listed, self.projects = entry
+                self.dirty = False
 
     def get_server(self):
         return self.server
 
-    def _execute(self, cmd, *args, **kws):
+    def _cli(self, cmd, *args, **kws):
         cli = list()
         cli.append(self.ssh)
+        cli.extend(kws.get('ssh_options') or list())
         cli.append('-p')
         cli.append('29418')
         cli.append(self.server)
@@ -38,53 +74,157 @@ class GerritCmd(Command):
         if len(args):
             cli.extend(args)
 
-        self.new_args(cli)
-        return self.wait(**kws)
+        return cli
+
+    def _dispatch(self, command, cmd, *args, **kws):
+        kws.setdefault('command_class', 'ssh')
+
+        pool = SshPool.get()
+        if pool is None:
+            command.new_args(self._cli(cmd, *args))
+            return command.dispatch(**kws)
+
+        def _dispatch(options, **kws):
+            command.new_args(self._cli(cmd, ssh_options=options, *args))
+            return command.dispatch(**kws)
+
+        host = self.server.rpartition('@')[2]
+        return pool.dispatch('%s:29418' % host, _dispatch, **kws)
+
+    def _execute(self, cmd, *args, **kws):
+        return self._dispatch(self, cmd, *args, **kws)
+
+    def _execute_alone(self, cmd, *args, **kws):
+        # run with a new command not to share the state between threads
+        return self._dispatch(Command(environ=self.env), cmd, *args, **kws)
+
+    def _is_listed(self, project):
+        for prefix in self.listed:
+            if project.startswith(prefix):
+                return True
+
+        return False
 
     def has_project_(self, project):
         if not self.enable:
             return True
 
         projects = self.ls_projects()
+        if not self._is_listed(project):
+            # query the project out of the prefixes by itself
+            projects = self.ls_projects(prefix=project)
+
         return project in projects
 
-    @synchronized
-    def ls_projects(self, force=False):
-        if not self.enable:
-            return list()
+    def _list_projects(self, prefix):
+        projects = set()
+        if self.rest is not None:
+            returncode, listed = self.rest.list_projects(prefix)
+            projects.update(listed)
+        else:
+            args = ['--prefix', prefix] if prefix else list()
+            for line in self._execute(
+                    'ls-projects', capture_stdout=True, stream=True, *args):
+                line = line.strip()
+                if line:
+                    projects.add(line)
 
-        if (self.dirty or force) and self._execute(
-                'ls-projects', capture_stdout=True) == 0:
+            returncode = self.returncode
+
+        if returncode == 0:
+            # replace the projects under the prefix with the listed ones
+            self.projects = projects | set([
+                project for project in self.projects
+                if not project.startswith(prefix)])
+            self.listed.add(prefix)
             self.dirty = False
-            self.projects = list()
 
-            for line in self.get_out_lines():
-                self.projects.append(line.strip())
+            if self.inventory is not None:
+                self.inventory.set(self.server, self.listed, self.projects)
+
+    def ls_projects(self, force=False, prefix=None):
+        """Returns the set of the projects on the server.
+
+        The projects are listed with the prefixes set by the constructor
+        unless "prefix" is specified. The prefixes listed before are reused
+        until "force" is set."""
+        if not self.enable:
+            return set()
+
+        with self.lock:
+            for pre in self.prefixes if prefix is None else [prefix]:
+                if force or self.dirty or not self._is_listed(pre):
+                    self._list_projects(pre)
+
+            return self.projects
+
+    def ls_heads(self, branches):
+        """Returns the heads of the branches of all projects in one call.
+
+        The result is a dict of the project to the dict of "refs/heads/..."
+        to SHA-1, in which the branches missing on the server are absent.
+        The projects are listed with the prefixes set by the constructor."""
+        heads = dict()
+        if not self.enable:
+            return 0, heads
+
+        for prefix in self.prefixes:
+            if self.rest is not None:
+                returncode, projects = self.rest.list_projects(
+                    prefix, branches)
+            else:
+                args = ['--format', 'json']
+                for branch in branches:
+                    args.extend(['-b', branch])
+                if prefix:
+                    args.extend(['--prefix', prefix])
+
+                with self.lock:
+                    returncode = self._execute(
+                        'ls-projects', capture_stdout=True, *args)
+                    output = self.get_output()
+
+                try:
+                    projects = json.loads(output or '{}')
+                except ValueError as e:
+                    Logger.get_logger('Gerrit').error('%s: %s', self.server, e)
+                    returncode = 1
+
+            if returncode != 0:
+                return returncode, dict()
 
-        return self.projects
+            for name, info in projects.items():
+                heads[name] = dict([
+                    ('refs/heads/%s' % branch, sha1)
+                    for branch, sha1 in (info.get('branches') or {}).items()])
+
+        return 0, heads
 
-    @synchronized
     def create_project(self, project, initial_commit=True, description=None,
-                       source=None, options=None):
+                       source=None, options=None, confirm=True):
+        """Creates the project if it's missing and returns the result.
+
+        If the creation failed, the project is confirmed by listing it again
+        unless "confirm" is False, and GerritError is raised if it's still
+        missing."""
         if not self.enable:
-            return
+            return 0
 
         logger = Logger.get_logger('Gerrit')
 
         project = project.strip()
         optcp = options and options.extra_values(
             options.extra_option, 'gerrit-cp')
-        if project not in self.ls_projects():
-            args = list()
+        if not self.has_project_(project):
+            params = dict()
             cp_value = optcp and optcp.boolean(optcp.empty_commit)
             if initial_commit or cp_value:
                 if cp_value is not False:
-                    args.append('--empty-commit')
+                    params['empty_commit'] = True
 
             # description=False means --no-description to suppress the function
             if optcp and optcp.description:
-                args.append('--description')
-                args.append("'%s'" % optcp.description.strip("'\""))
+                params['description'] = optcp.description.strip("'\"")
             elif not description == False:
                 if not description:
                     description = "Mirror of %url"
@@ -95,35 +235,121 @@ class GerritCmd(Command):
                 if description.find('%url') > -1:
                     logger.warning("gerrit url is being missed")
                 else:
-                    args.append('--description')
-                    args.append("'%s'" % description.strip("'\""))
+                    params['description'] = description.strip("'\"")
 
             if optcp:
-                if optcp.branch:
-                    args.append('--branch')
-                    args.append(optcp.branch)
-                if optcp.owner:
-                    args.append('--owner')
-                    args.append(optcp.owner)
-                if optcp.parent:
-                    args.append('--parent')
-                    args.append(optcp.parent)
-
-            args.append(project)
-            ret = self._execute('create-project', *args)
+                params['branch'] = optcp.branch
+                params['owner'] = optcp.owner
+                params['parent'] = optcp.parent
+
+            ret = self._create_project(project, **params)
             if ret:
                 # try fetching the latest project to confirm the result
                 # if gerrit reports the mistake to create the repository
-                if project not in self.ls_projects(force=True):
+                if confirm and project not in self.ls_projects(
+                        force=True, prefix=project):
                     raise GerritError(
                         'Gerrit: cannot create "%s" on remote "%s"'
                         % (project, self.server))
+            else:
+                with self.lock:
+                    self.projects = self.projects | set([project])
+                    if self.inventory is not None:
+                        self.inventory.update(
+                            self.server, self.listed, self.projects)
+
+            return ret
         else:
             logger.debug('%s existed in the remote', project)
 
-    @synchronized
-    def create_branch(self, branch):
-        if self.enable:
-            return self._execute('create-branch', branch)
-        else:
+        return 0
+
+    def _create_project(self, project, empty_commit=False, description=None,
+                        branch=None, owner=None, parent=None):
+        if self.rest is not None:
+            return self.rest.create_project(
+                project, empty_commit=empty_commit, description=description,
+                branch=branch, owner=owner, parent=parent)
+
+        args = list()
+        if empty_commit:
+            args.append('--empty-commit')
+        if description:
+            args.append('--description')
+            args.append("'%s'" % description)
+        if branch:
+            args.append('--branch')
+            args.append(branch)
+        if owner:
+            args.append('--owner')
+            args.append(owner)
+        if parent:
+            args.append('--parent')
+            args.append(parent)
+
+        args.append(project)
+
+        return self._execute_alone('create-project', *args)
+
+    def create_projects(self, projects, jobs=None, initial_commit=True,
+                        description=None, options=None):
+        """Creates the missing projects with "jobs" workers in parallel.
+
+        The projects failed to create are confirmed by listing the projects
+        once at the end, and GerritError is raised if any of them is still
+        missing."""
+        if not self.enable:
+            return
+
+        logger = Logger.get_logger('Gerrit')
+
+        missing, names = list(), set()
+        for project in projects:
+            project = project.strip()
+            if project not in names and not self.has_project_(project):
+                missing.append(project)
+
+            names.add(project)
+
+        if not missing:
+            return
+
+        logger.info('Create %d projects on %s', len(missing), self.server)
+
+        def _create(project):
+            return not self.create_project(
+                project, initial_commit=initial_commit,
+                description=description, options=options, confirm=False)
+
+        with WorkerPool(jobs, keep_going=True) as pool:
+            results = pool.run(missing, _create)
+
+        failures = [
+            result.task for result in results if not result.succeeded()]
+        if failures:
+            # confirm the failures with the projects listed once
+            projects = self.ls_projects(force=True)
+            failed = list()
+            for project in failures:
+                for prefix in self.prefixes:
+                    if project.startswith(prefix):
+                        break
+                else:
+                    projects = self.ls_projects(force=True, prefix=project)
+
+                if project not in projects:
+                    failed.append(project)
+
+            if failed:
+                raise GerritError(
+                    'Gerrit: cannot create "%s" on remote "%s"'
+                    % ('", "'.join(failed), self.server))
+
+    def create_branch(self, project, branch, revision='HEAD'):
+        if not self.enable:
             return 0
+        elif self.rest is not None:
+            return self.rest.create_branch(project, branch, revision)
+        else:
+            return self._execute_alone(
+                'create-branch', project, branch, revision)
@@ -0,0 +1,59 @@
+import os
+
+from json_cache import JsonCache
+
+
+class GerritInventory(JsonCache):
+    """Saves the projects listed from the Gerrit servers across the runs.
+
+    Each server is saved as a JSON file in the directory ".krep" of the
+    working directory with the listed prefixes, which are empty for all
+    projects. The projects are reused until the TTL expires, so that the
+    projects needn't be listed with ssh in the following runs."""
+
+    DIRECTORY = '.krep/gerrit-projects'
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--refs') or \
+            optparse.add_option_group('Remote options')
+        options.add_option(
+            '--gerrit-cache-ttl',
+            dest='gerrit_cache_ttl', action='store', type='int',
+            metavar='SECONDS',
+            help='Cache the projects of the gerrit server in the working '
+                 'directory and reuse them in the seconds instead of running '
+                 'ls-projects. It is disabled by default')
+
+    @staticmethod
+    def build(options, working_dir):
+        if options.gerrit_cache_ttl and options.gerrit_cache_ttl > 0:
+            return GerritInventory(
+                os.path.join(working_dir, GerritInventory.DIRECTORY),
+                options.gerrit_cache_ttl)
+        else:
+            return None
+
+    def get(self, server):
+        """Returns the listed prefixes and the projects or None if they're
+        missing or expired."""
+        entry = self.load_fresh(server)
+        if entry:
+            return (set(entry.get('prefixes') or list()),
+                    set(entry.get('projects') or list()))
+
+        return None
+
+    def set(self, server, prefixes, projects):
+        """Saves the projects just listed from the server."""
+        self.save(
+            server, prefixes=sorted(prefixes), projects=sorted(projects))
+
+    def update(self, server, prefixes, projects):
+        """Saves the projects created on the server, the listing time is kept
+        not to extend the expiration."""
+        self.touch(
+            server, prefixes=sorted(prefixes), projects=sorted(projects))
+
+
+TOPIC_ENTRY = 'GerritInventory'
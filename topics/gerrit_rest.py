@@ -0,0 +1,199 @@
+import base64
+import json
+import netrc
+import threading
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
+try:
+    from urllib.parse import quote, urlencode, urlparse
+except ImportError:
+    from urllib import quote, urlencode
+    from urlparse import urlparse
+
+from logger import Logger
+
+
+class GerritRest(object):
+    """Accesses the Gerrit REST API with the keep-alive HTTP connections.
+
+    The connections are pooled and reused by the requests, the credentials
+    are read from the url or the netrc file. The authenticated API with the
+    prefix "/a" is used once the credentials are found."""
+
+    # the magic prefix of the JSON response against XSSI
+    MAGIC = ")]}'"
+    # the projects listed per request
+    LIMIT = 500
+
+    def __init__(self, url, timeout=60):
+        ulp = urlparse(url)
+
+        self.url = url
+        self.https = ulp.scheme == 'https'
+        self.host = ulp.hostname
+        self.port = ulp.port
+        self.path = ulp.path.rstrip('/')
+        self.timeout = timeout
+
+        self.auth = None
+        username, password = ulp.username, ulp.password
+        if not username:
+            try:
+                auth = netrc.netrc().authenticators(self.host)
+                if auth:
+                    username, _, password = auth
+            except (IOError, netrc.NetrcParseError):
+                pass
+
+        if username:
+            self.auth = 'Basic %s' % base64.b64encode(
+                ('%s:%s' % (username, password or '')).encode('utf-8')
+            ).decode('utf-8')
+            self.path += '/a'
+
+        self.lock = threading.Lock()
+        self.connections = list()
+
+    def _acquire(self):
+        """Returns a connection and whether it's reused from the pool."""
+        with self.lock:
+            if self.connections:
+                return self.connections.pop(), True
+
+        if self.https:
+            return httplib.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout), False
+        else:
+            return httplib.HTTPConnection(
+                self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, connection):
+        with self.lock:
+            self.connections.append(connection)
+
+    def request(self, method, path, data=None):
+        """Returns the HTTP status and the decoded JSON response."""
+        logger = Logger.get_logger('Gerrit')
+
+        headers = {'Accept': 'application/json'}
+        if self.auth:
+            headers['Authorization'] = self.auth
+
+        body = None
+        if data is not None:
+            body = json.dumps(data)
+            headers['Content-Type'] = 'application/json; charset=UTF-8'
+
+        logger.debug('%s %s%s', method, self.path, path)
+        while True:
+            connection, reused = self._acquire()
+            try:
+                try:
+                    connection.request(
+                        method, '%s%s' % (self.path, path), body, headers)
+                except (httplib.HTTPException, IOError):
+                    # the request failed to send on the idle connection
+                    # closed by the server is safe to send again
+                    connection.close()
+                    if reused:
+                        continue
+
+                    raise
+
+                try:
+                    response = connection.getresponse()
+                except httplib.BadStatusLine:
+                    # likewise the connection is closed without a response,
+                    # but not retry the others which may be processed
+                    connection.close()
+                    if reused:
+                        continue
+
+                    raise
+
+                content = response.read().decode('utf-8')
+            except (httplib.HTTPException, IOError) as e:
+                connection.close()
+                logger.error('%s: %s', self.url, e)
+                return 0, None
+
+            self._release(connection)
+            if content.startswith(GerritRest.MAGIC):
+                content = content[len(GerritRest.MAGIC):]
+
+            try:
+                return response.status, json.loads(content)
+            except ValueError:
+                return response.status, content.strip()
+
+    def list_projects(self, prefix=None, branches=None):
+        """Lists the projects page by page and returns the return code with
+        the dict of the names to the information of the projects.
+
+        The heads of the branches are included in the information with the
+        key "branches" if "branches" is set."""
+        listed = dict()
+        start = 0
+        while True:
+            params = [('d', ''), ('n', GerritRest.LIMIT), ('S', start)]
+            if prefix:
+                params.append(('p', prefix))
+            for branch in branches or list():
+                params.append(('b', branch))
+
+            status, projects = self.request(
+                'GET', '/projects/?%s' % urlencode(params))
+            if status != 200 or not isinstance(projects, dict):
+                Logger.get_logger('Gerrit').error(
+                    '%s: failed to list projects: %s', self.url, projects)
+                return 1, dict()
+
+            listed.update(projects)
+
+            if len(projects) < GerritRest.LIMIT:
+                break
+
+            start += len(projects)
+
+        return 0, listed
+
+    def create_project(self, project, empty_commit=False, description=None,
+                       branch=None, owner=None, parent=None):
+        data = dict(name=project, create_empty_commit=bool(empty_commit))
+        if description:
+            data['description'] = description
+        if branch:
+            data['branches'] = [branch]
+        if owner:
+            data['owners'] = [owner]
+        if parent:
+            data['parent'] = parent
+
+        status, message = self.request(
+            'PUT', '/projects/%s' % quote(project, safe=''), data)
+        if status != 201:
+            Logger.get_logger('Gerrit').error(
+                '%s: failed to create %s: %s', self.url, project, message)
+            return 1
+
+        return 0
+
+    def create_branch(self, project, branch, revision='HEAD'):
+        status, message = self.request(
+            'PUT', '/projects/%s/branches/%s' % (
+                quote(project, safe=''), quote(branch, safe='')),
+            dict(revision=revision))
+        if status != 201:
+            Logger.get_logger('Gerrit').error(
+                '%s: failed to create %s in %s: %s', self.url, branch,
+                project, message)
+            return 1
+
+        return 0
+
+
+TOPIC_ENTRY = 'GerritRest'
@@ -1,17 +1,23 @@
-
 import os
 
 from command import Command
+from dir_utils import absolute_path, get_base_dir
 from files.file_utils import FileUtils
+from ssh_pool import SshPool
 
 
 class GitCommand(Command):
     """Executes a git sub-command with specified parameters"""
+    # the sub-commands connecting to the remote
+    REMOTE_COMMANDS = ('clone', 'fetch', 'ls-remote', 'pull', 'push')
+
     def __init__(self, gitdir=None, worktree=None, *args, **kws):
+        if worktree:
+            worktree = absolute_path(worktree)
         Command.__init__(self, cwd=worktree, *args, **kws)
 
-        self.gitdir = gitdir
-        self.worktree = worktree or os.getcwd()
+        self.gitdir = gitdir and absolute_path(gitdir)
+        self.worktree = worktree or get_base_dir()
         self.git = FileUtils.find_execute('git')
 
     def _execute(self, *args, **kws):
@@ -32,7 +38,56 @@ class GitCommand(Command):
             cli.extend(args)
 
         self.new_args(cli)
-        return self.wait(**kws)
+        if args and args[0] in GitCommand.REMOTE_COMMANDS:
+            kws.setdefault(
+                'command_class', 'push' if args[0] == 'push' else 'fetch')
+
+        pool = SshPool.get()
+        key = pool and args and args[0] in GitCommand.REMOTE_COMMANDS and \
+            SshPool.get_key(self._remote_url(args[1:]))
+        command = key and self._ssh_command(self.get_env(kws))
+        if not command:
+            return self.dispatch(**kws)
+
+        def _dispatch(options, **kws):
+            # set for the call not to keep the session in the command
+            kws['environ'] = dict(
+                kws.get('environ') or dict(),
+                GIT_SSH_COMMAND=SshPool.git_ssh_command(options, command))
+
+            return self.dispatch(**kws)
+
+        return pool.dispatch(key, _dispatch, **kws)
+
+    def _remote_url(self, args):
+        """Returns the url of the first non-option argument, which may be the
+        name of a remote."""
+        for arg in args:
+            if arg.startswith('-'):
+                continue
+            elif ':' in arg or '/' in arg:
+                return arg
+
+            command = GitCommand(self.gitdir, self.worktree)
+            ret, url = command.config('--get', 'remote.%s.url' % arg)
+
+            return url if ret == 0 else None
+
+        return None
+
+    def _ssh_command(self, environ):
+        """Returns the ssh command run by git in its order of precedence, or
+        None if it's set with GIT_SSH, which can't take the ssh options."""
+        if environ.get('GIT_SSH_COMMAND'):
+            return environ['GIT_SSH_COMMAND']
+        elif environ.get('GIT_SSH'):
+            return None
+
+        command = GitCommand(self.gitdir, self.worktree)
+        ret, value = command.config('--get', 'core.sshCommand')
+        value = (value or '').strip()
+
+        return value if ret == 0 and value else 'ssh'
 
     def raw_command(self, *args, **kws):
         return self._execute(*args, **kws)
@@ -42,6 +97,11 @@ class GitCommand(Command):
 
         return res, self.get_output()
 
+    def raw_command_with_lines(self, *args, **kws):
+        """Returns the iterator of output lines, the return code is set to
+        "returncode" once the iterator is exhausted."""
+        return self._execute(capture_stdout=True, stream=True, *args, **kws)
+
     def set_path(self, gitdir=None, worktree=None):
         if gitdir:
             self.gitdir = gitdir
@@ -82,6 +142,9 @@ class GitCommand(Command):
         return self.raw_command(
             'fetch', capture_stdout=False, capture_stderr=False, *args, **kws)
 
+    def for_each_ref(self, *args, **kws):
+        return self.raw_command_with_output('for-each-ref', *args, **kws)
+
     def log(self, *args, **kws):
         return self.raw_command_with_output('log', *args, **kws)
 
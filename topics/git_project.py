@@ -1,16 +1,19 @@
 
 import os
 import re
+import threading
 
 try:
     from urllib.parse import urlparse
 except ImportError:
     from urlparse import urlparse
 
+from command import Command
 from error import DownloadError, ProcessingError
 from git_cmd import GitCommand
 from logger import Logger
 from project import Project
+from worker_pool import WorkerPool
 
 
 def _sha1_equals(sha, shb):
@@ -30,6 +33,17 @@ def _ensure_remote(url):
     return url
 
 
+def _int_value(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _is_plain_ref(rev):
+    return rev and not re.search(r'[\s~:?*\[\\]|@\{|\^(?!\{\}$)', rev)
+
+
 def _secure_head_name(head):
     heads = head.split('/')
     while len(heads) > 1 and heads[0] in ('remotes', 'origin'):
@@ -42,6 +56,11 @@ class GitProject(Project, GitCommand):
     CATEGORY_TAGS = 'tag,revision'
     CATEGORY_REVISION = 'revision'
 
+    # the rules "git rev-parse" follows to expand a short ref name
+    REF_RULES = (
+        '%s', 'refs/%s', 'refs/tags/%s', 'refs/heads/%s',
+        'refs/remotes/%s', 'refs/remotes/%s/HEAD')
+
     extra_items = (
         ('Git options for git-clone:', (
             ('git-clone:reference', 'Set reference repository'),
@@ -53,6 +72,11 @@ class GitProject(Project, GitCommand):
         ('Git options for git-push:', (
             ('git-push:no-thin', 'Don\'t use thin transfer'),
             ('git-push:skip-validation', 'Don\'t validate the commit number'),
+            ('git-push:chunk-size', 'Push at most the refspecs per push'),
+            ('git-push:chunk-jobs', 'Push the chunks in parallel'),
+            ('git-push:chunk-retries', 'Retry times of a failed chunk'),
+            ('git-push:progressive-commits',
+             'Push the new heads in first-parent steps of the commits'),
         )),
     )
 
@@ -73,15 +97,28 @@ class GitProject(Project, GitCommand):
         # gitdir will be secured before executing the command per time
         GitCommand.__init__(self, gitdir, worktree, *args, **kws)
 
+        # local refs loaded with load_local_refs() to resolve in memory
+        self.local_refs = None
+        # checked-out branch and symbolic refs loaded with the local refs
+        self.local_head = None
+        self.local_symrefs = None
+        # snapshot of the remote heads and tags shared by the push methods
+        self.remote_refs = None
+        # RemoteRefCache to keep the snapshot across the runs
+        self.ref_cache = None
+        # branches and their remote heads listed with all projects
+        self.heads_inventory = None
+
         if uri is None:
             ret, url = self.ls_remote('--get-url')
             if ret == 0:
                 ulp = urlparse(url)
                 uri = ulp.path.lstrip('/')
 
+        # the worktree has been resolved with the base directory
         Project.__init__(
-            self, uri, worktree, revision, _ensure_remote(remote),
-            pattern, *args, **kws)
+            self, uri, worktree and self.worktree, revision,
+            _ensure_remote(remote), pattern, *args, **kws)
 
     def update_(self, name, remote=None):
         if remote:
@@ -166,76 +203,247 @@ class GitProject(Project, GitCommand):
 
         return ret
 
+    @staticmethod
+    def _parse_ls_remote(lines):
+        refs = dict()
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+
+            sha1, ref = re.split(r'\s+', line, maxsplit=1)
+            refs[ref] = sha1
+
+        return refs
+
+    def set_ref_cache(self, cache):
+        self.ref_cache = cache
+
+    def _load_cached_remote_refs(self):
+        if self.remote_refs is None and self.ref_cache is not None:
+            self.remote_refs = self.ref_cache.get(self.remote)
+
+        return self.remote_refs
+
+    def get_remote_refs(self, remote=None, refresh=False):
+        """Returns the remote heads and tags listed by a single ls-remote.
+
+        The result for the project remote is kept as the snapshot until it's
+        refreshed or invalidated by the push."""
+        if remote and remote != self.remote:
+            refs = GitProject._parse_ls_remote(
+                self.raw_command_with_lines(
+                    'ls-remote', '--heads', '--tags', remote, notdir=True))
+
+            return self.returncode, refs
+
+        if not refresh:
+            self._load_cached_remote_refs()
+
+        if self.remote_refs is None or refresh:
+            refs = GitProject._parse_ls_remote(
+                self.raw_command_with_lines(
+                    'ls-remote', '--heads', '--tags', self.remote,
+                    notdir=True))
+            if self.returncode != 0:
+                return self.returncode, refs
+
+            self.set_remote_refs(refs)
+
+        return 0, self.remote_refs
+
+    def set_remote_refs(self, refs):
+        self.remote_refs = refs
+        if self.ref_cache is not None:
+            self.ref_cache.set(self.remote, refs)
+
+    def invalidate_remote_refs(self):
+        self.remote_refs = None
+        if self.ref_cache is not None:
+            self.ref_cache.remove(self.remote)
+
+    def set_heads_inventory(self, branches, heads):
+        """Sets the remote heads of the branches, which are listed with the
+        other projects by Gerrit. The branches absent in "heads" are missing
+        on the remote."""
+        self.heads_inventory = (set(branches), dict(heads))
+
+    @staticmethod
+    def _filter_refs(refs, prefix):
+        return dict([(ref, sha1) for ref, sha1 in refs.items()
+                     if ref.startswith(prefix)])
+
     def get_remote_tags(self, remote=None):
-        tags = dict()
-        ret, result = self.ls_remote('--tags', remote or self.remote)
-        if ret == 0 and result:
-            for line in result.split('\n'):
-                sha1, tag = re.split(r'\s+', line, maxsplit=1)
-                tags[tag] = sha1
+        ret, refs = self.get_remote_refs(remote)
 
-        return ret, tags
+        return ret, GitProject._filter_refs(refs, 'refs/tags/')
 
     def get_remote_heads(self, remote=None):
-        heads = dict()
+        ret, refs = self.get_remote_refs(remote)
 
-        ret, result = self.ls_remote('--heads', remote or self.remote)
-        if ret == 0 and result:
-            for line in result.split('\n'):
-                line = line.strip()
-                if not line:
-                    continue
+        return ret, GitProject._filter_refs(refs, 'refs/heads/')
 
-                sha1, head = re.split(r'\s+', line, maxsplit=1)
-                heads[head] = sha1
+    def _update_remote_refs(self, refspecs):
+        """Applies the pushed refspecs to the remote snapshot, which will be
+        invalidated if any of the refspecs cannot be resolved locally."""
+        if self.remote_refs is None:
+            return
 
-        return ret, heads
+        updates = dict()
+        for refspec in refspecs:
+            src, _, dest = refspec.lstrip('+').partition(':')
+            if self.local_refs is None or not dest.startswith('refs/'):
+                self.invalidate_remote_refs()
+                return
+
+            if src.endswith('/*') and dest.endswith('*'):
+                for ref, sha1 in self.local_refs.items():
+                    if ref.startswith(src[:-1]):
+                        updates[dest[:-1] + ref[len(src) - 1:]] = sha1
+
+                continue
+
+            _, sha1 = self.resolve_rev(src)
+            if not sha1 or '*' in refspec:
+                self.invalidate_remote_refs()
+                return
+
+            updates[dest] = sha1
+            peeled = self._lookup_local_ref('%s^{}' % src)
+            if peeled and peeled != sha1:
+                updates['%s^{}' % dest] = peeled
+
+        self.remote_refs.update(updates)
+        if self.ref_cache is not None:
+            self.ref_cache.update(self.remote, self.remote_refs)
+
+    def list_local_heads(self, current=True, remotes=True, git_repo=True,
+                         detached=False):
+        """Lists the local branches from the loaded local refs.
+
+        The local branches are named without "refs/heads/" and the
+        remote-tracking ones as "remotes/<remote>/<branch>". The symbolic refs
+        like "remotes/origin/HEAD" are always excluded. Other heads are
+        filtered with the arguments:
+
+          current: include the checked-out branch
+          remotes: include the remote-tracking branches
+          git_repo: include "remotes/m/*" created by git-repo
+          detached: include "HEAD" if it's detached"""
+        if self.local_refs is None:
+            ret, _ = self.load_local_refs()
+            if ret != 0:
+                return ret, dict()
 
-    def get_local_heads(self, local=False, git_repo=False):
         heads = dict()
-        ret, lines = self.branch('-lva')
-        if ret == 0:
-            for line in lines.split('\n'):
-                line = line.strip()
-                if re.search(r'^remotes/.*/HEAD', line):
+        for ref, sha1 in self.local_refs.items():
+            if ref in self.local_symrefs or ref.endswith('^{}'):
+                continue
+            elif ref.startswith('refs/heads/'):
+                if not current and ref == self.local_head:
                     continue
-                elif line.startswith('remotes/m/') and git_repo:
-                    # created by git-repo, ignore
+
+                heads[ref[len('refs/heads/'):]] = sha1
+            elif ref.startswith('refs/remotes/') and remotes:
+                if ref.endswith('/HEAD'):
                     continue
-                elif line.startswith('*'):
-                    line = line[1:].lstrip()
-                    if line.startswith('(HEAD detached at '):
-                        continue
-                    elif not (self.bare or local):
-                        continue
-                elif not line:
+                elif ref.startswith('refs/remotes/m/') and not git_repo:
                     continue
 
-                if line.startswith('(no branch)'):
-                    continue
+                heads[ref[len('refs/'):]] = sha1
 
-                head = re.split(r'[\s]+', line, maxsplit=2)
-                if head[1] != '->':
-                    heads[head[0]] = head[1]
+        if detached and self.local_head is None and not self.bare:
+            ret, sha1 = self.rev_parse('HEAD', capture_stderr=False)
+            if ret == 0 and sha1:
+                heads['HEAD'] = sha1
 
-        return ret, heads
+        return 0, heads
+
+    def get_local_heads(self, local=False, git_repo=False):
+        return self.list_local_heads(
+            current=self.bare or local, git_repo=not git_repo)
 
     def get_local_tags(self):
         tags = dict()
-        ret, lines = self.show_ref('--tags')
-        if ret == 0:
-            for line in lines.split('\n'):
-                match = re.split(r'\s+', line)
+        for line in self.raw_command_with_lines('show-ref', '--tags'):
+            match = re.split(r'\s+', line.strip())
+            if len(match) > 1:
                 tags[match[1].replace('refs/tags/', '')] = match[0]
 
-        return ret, tags
+        return self.returncode, tags
 
     @staticmethod
     def is_sha1(sha1):
         return re.match('^[0-9a-f]{6,40}$', sha1)
 
+    def load_local_refs(self):
+        """Loads all local refs with a single "git for-each-ref".
+
+        The peeled object of an annotated tag is recorded with the suffix
+        "^{}" like "git show-ref -d" does. The checked-out branch and the
+        symbolic refs are recorded as well to list the local heads."""
+        refs, symrefs, head = dict(), set(), None
+        ret, lines = self.for_each_ref(
+            '--format=%(objectname)%09%(refname)%09%(*objectname)'
+            '%09%(HEAD)%09%(symref)',
+            capture_stderr=False)
+        if ret == 0:
+            for line in lines.split('\n'):
+                items = line.split('\t') + [''] * 4
+                if not items[1]:
+                    continue
+
+                refs[items[1]] = items[0]
+                if items[2]:
+                    refs['%s^{}' % items[1]] = items[2]
+                if items[3] == '*':
+                    head = items[1]
+                if items[4]:
+                    symrefs.add(items[1])
+
+            self.local_refs = refs
+            self.local_head = head
+            self.local_symrefs = symrefs
+        else:
+            self.invalidate_local_refs()
+
+        return ret, refs
+
+    def invalidate_local_refs(self):
+        self.local_refs = None
+        self.local_head = None
+        self.local_symrefs = None
+
+    def _lookup_local_ref(self, rev):
+        peeled = rev.endswith('^{}')
+        if peeled:
+            rev = rev[:-3]
+
+        for rule in GitProject.REF_RULES:
+            name = rule % rev
+            if name in self.local_refs:
+                if peeled:
+                    return self.local_refs.get(
+                        '%s^{}' % name, self.local_refs[name])
+                else:
+                    return self.local_refs[name]
+
+        return None
+
+    def resolve_rev(self, rev):
+        """Resolves the revision with the loaded refs if possible.
+
+        It falls back to "git rev-parse" if the local refs aren't loaded or
+        the revision isn't a plain ref name."""
+        if self.local_refs is not None and _is_plain_ref(rev) \
+                and not self.is_sha1(rev):
+            sha1 = self._lookup_local_ref(rev)
+            return (0, sha1) if sha1 else (1, '')
+
+        return self.rev_parse(rev, capture_stderr=False)
+
     def rev_existed(self, rev):
-        ret, _ = self.rev_parse(rev, capture_stderr=False)
+        ret, _ = self.resolve_rev(rev)
 
         return ret == 0
 
@@ -262,20 +470,201 @@ class GitProject(Project, GitCommand):
 
         return parameters
 
-    def push_heads(  # pylint: disable=R0915
+    def _push_chunk(self, command, refspecs, extra, *args, **kws):
+        logger = Logger.get_logger()
+
+        retries = _int_value(extra and extra.chunk_retries)
+        cargs = GitProject._push_args(
+            list(), extra, *(list(refspecs) + list(args)))
+        for retry in range(retries + 1):
+            if retry:
+                logger.warning(
+                    '%s: retry to push %d refspecs (%d/%d)', self.remote,
+                    len(refspecs), retry, retries)
+
+            ret = command.push(self.remote, *cargs, **kws)
+            if ret == 0:
+                break
+
+        return ret
+
+    def _progressive_heads(self, refspecs):
+        """Returns the pairs of the local SHA-1 and the remote head to push
+        with the refspecs, the wildcard refspecs are expanded."""
+        if self.local_refs is None:
+            self.load_local_refs()
+
+        heads = list()
+        for refspec in refspecs:
+            src, _, dest = refspec.lstrip('+').partition(':')
+            if not dest.startswith('refs/heads/'):
+                continue
+
+            if src.endswith('/*') and dest.endswith('*'):
+                for ref, sha1 in (self.local_refs or dict()).items():
+                    if ref.startswith(src[:-1]) and not ref.endswith('^{}'):
+                        heads.append((sha1, dest[:-1] + ref[len(src) - 1:]))
+            elif '*' not in refspec:
+                _, sha1 = self.resolve_rev(src)
+                if sha1:
+                    heads.append((sha1, dest))
+
+        return heads
+
+    def _progressive_steps(self, sha1, dest, step, logger):
+        """Returns the first-parent commits to push to "dest" one by one
+        before "sha1", which are "step" commits apart.
+
+        The commits reachable from the remote heads have been on the server
+        and are excluded, so that the steps resume from the last one pushed
+        and the heads sharing the history won't be stepped again."""
+        remote_sha1 = self.remote_refs.get(dest)
+        if remote_sha1:
+            if _sha1_equals(remote_sha1, sha1):
+                return list()
+
+            ret = self.raw_command(
+                'merge-base', '--is-ancestor', remote_sha1, sha1,
+                capture_stderr=False)
+            if ret != 0:
+                logger.info(
+                    '%s is not fast-forwarded, push without steps', dest)
+                return list()
+
+        excludes = set([
+            remote for ref, remote in self.remote_refs.items()
+            if ref.startswith('refs/heads/')])
+        commits = [line.strip() for line in self.raw_command_with_lines(
+            'rev-list', '--first-parent', '--reverse', '--ignore-missing',
+            sha1, '--not', *sorted(excludes))]
+        if self.returncode != 0:
+            return list()
+
+        # the last commit is pushed with the original refspec
+        return commits[step - 1:-1:step]
+
+    def push_progressively(self, refspecs, extra, *args, **kws):
+        """Pushes the history of the heads in first-parent steps with the
+        extra option "git-push:progressive-commits".
+
+        Each step updates the remote head with an intermediate commit so that
+        the server needn't receive the whole history in a single pack. The
+        original refspecs are expected to be pushed later."""
+        logger = Logger.get_logger()
+
+        step = _int_value(extra and extra.progressive_commits)
+        if step <= 0 or kws.get('dryrun'):
+            return 0
+
+        if self.remote_refs is None:
+            ret, _ = self.get_remote_refs()
+            if ret != 0:
+                return ret
+
+        for sha1, dest in self._progressive_heads(refspecs):
+            commits = self._progressive_steps(sha1, dest, step, logger)
+            for index, commit in enumerate(commits):
+                logger.info(
+                    '%s: push step %d/%d of %s', self.remote, index + 1,
+                    len(commits), dest)
+
+                ret = self._push_chunk(
+                    self, ['%s:%s' % (commit, dest)], extra, *args, **kws)
+                if ret != 0:
+                    logger.error(
+                        '%s: failed to push %s to %s', self.remote, commit,
+                        dest)
+                    self.invalidate_remote_refs()
+                    return ret
+
+                self.remote_refs[dest] = commit
+
+        return 0
+
+    def push_refspecs(self, refspecs, options=None, *args, **kws):
+        """Pushes the refspecs and updates the remote snapshot.
+
+        The new history of the heads is pushed by push_progressively() at
+        first if it's enabled. With the extra option "git-push:chunk-size",
+        the refspecs are split into chunks not to exceed the command line or
+        the server limits. The chunks are pushed by a WorkerPool with
+        "git-push:chunk-jobs" workers and each of them is retried
+        "git-push:chunk-retries" times on its own."""
+        extra = options and options.extra
+        if kws.get('loop') is not None:
+            if extra and (extra.chunk_size or extra.progressive_commits):
+                Logger.get_logger().warning(
+                    '%s: no chunks or progressive steps in the event loop, '
+                    'push the refspecs at once', self.remote)
+
+            cargs = GitProject._push_args(
+                list(), extra, *(list(refspecs) + list(args)))
+
+            return self.push(self.remote, *cargs, **kws)
+
+        ret = self.push_progressively(refspecs, extra, *args, **kws)
+        if ret != 0:
+            return ret
+
+        refspecs = list(refspecs)
+        size = _int_value(extra and extra.chunk_size) or len(refspecs) or 1
+        chunks = [refspecs[i:i + size]
+                  for i in range(0, len(refspecs), size)] or [list()]
+        jobs = min(_int_value(extra and extra.chunk_jobs, 1), len(chunks))
+
+        lock = threading.Lock()
+
+        def _push(chunk):
+            command = self
+            if jobs > 1:
+                # commands keep the state, not to share between threads
+                command = GitCommand(self.gitdir, self.worktree)
+                command.env = dict(self.env)
+
+            ret = self._push_chunk(command, chunk, extra, *args, **kws)
+            with lock:
+                if not kws.get('dryrun'):
+                    if ret == 0:
+                        self._update_remote_refs(chunk)
+                    else:
+                        self.invalidate_remote_refs()
+
+            return ret == 0
+
+        # the chunks share the deadline of the task and the job budget,
+        # and are retried by the option "git-push:chunk-retries" only
+        timeout = Command._get_timeout()  # pylint: disable=W0212
+        with WorkerPool(jobs, keep_going=True, timeout=timeout) as pool:
+            results = pool.run(chunks, _push)
+
+        failures = [result for result in results if not result.succeeded()]
+        if len(chunks) > 1 and failures:
+            Logger.get_logger().error(
+                '%s: %d of %d chunks failed to push', self.remote,
+                len(failures), len(chunks))
+
+        return 1 if failures else 0
+
+    def heads_refspecs(  # pylint: disable=R0915
             self, branch=None, refs=None, patterns=None, options=None,
-            force=False, logger=None, *args, **kws):
+            force=False, logger=None, remote_heads=None, remote_tags=None):
+        """Returns the refspecs to push the local heads.
+
+        The remote heads and tags retrieved from the remote are used to
+        skip the up-to-date heads."""
         if not logger:
             logger = Logger.get_logger()
 
         if patterns and not isinstance(patterns, (list, tuple)):
             patterns = [patterns]
 
+        remote_heads = remote_heads or dict()
+        remote_tags = remote_tags or dict()
+
         refs = (refs and '%s/' % refs.rstrip('/')) or ''
-        ret, local_heads = self.get_local_heads(
+        self.load_local_refs()
+        _, local_heads = self.get_local_heads(
             local=True, git_repo=options.git_repo)
-        ret, remote_heads = self.get_remote_heads()
-        ret, remote_tags = self.get_remote_tags()
 
         if not options.push_all:
             local_heads = {
@@ -286,13 +675,8 @@ class GitProject(Project, GitCommand):
                   or self.pattern.has_category(GitProject.CATEGORY_REVISION)
                   or self.pattern.can_replace(
                       GitProject.CATEGORY_REVISION, local_heads)):
-            cargs = GitProject._push_args(
-                list(), options.extra,
-                '%srefs/heads/*:refs/heads/%s*' % (
-                    '+' if force else '', refs),
-                *args)
-
-            return self.push(self.remote, *cargs, **kws)
+            return ['%srefs/heads/*:refs/heads/%s*' % (
+                '+' if force else '', refs)]
 
         prefs = list()
         for origin in local_heads:
@@ -360,12 +744,11 @@ class GitProject(Project, GitCommand):
                 logger.info('%s has been up-to-dated', remote_ref)
                 skip = True
 
-            ret = 0
             if not skip:
                 prefs.append(
                     '%s%s:%s' % ('+' if force else '', local_ref, remote_ref))
 
-            if ret == 0 and not options.push_all and (
+            if not options.push_all and (
                     options.sha1tag and self.is_sha1(origin)):
                 equals = False
                 if options.sha1tag in remote_tags:
@@ -377,47 +760,49 @@ class GitProject(Project, GitCommand):
                         '%s%s:%s' % (
                             '+' if force else '', local_ref, options.sha1tag))
 
-        if prefs:
-            cargs = GitProject._push_args(list(), options.extra, *prefs)
-            ret = self.push(self.remote, *cargs, **kws)
+        return prefs
 
-        if ret != 0:
-            logger.error('error to execute git push to %s', self.remote)
+    def push_heads(self, branch=None, refs=None, patterns=None, options=None,
+                   force=False, logger=None, *args, **kws):
+        return self.push_refs(
+            dict(branch=branch, refs=refs, patterns=patterns,
+                 options=options, force=force),
+            None, logger, *args, **kws)
 
-        return ret
+    def tags_refspecs(self, tags=None, refs=None, patterns=None,  # pylint: disable=R0915
+                      force=False, options=None, logger=None,
+                      remote_tags=None):
+        """Returns the refspecs to push the local tags.
 
-    def push_tags(self, tags=None, refs=None, patterns=None,  # pylint: disable=R0915
-                  force=False, options=None, logger=None, *args, **kws):
+        The tags retrieved from the remote are used to skip the up-to-date
+        tags."""
         if not logger:
             logger = Logger.get_logger()
 
-        refs = (refs and '%s/' % refs.rstrip('/')) or ''
-        ret, remote_tags = self.get_remote_tags()
+        remote_tags = remote_tags or dict()
 
+        refs = (refs and '%s/' % refs.rstrip('/')) or ''
         local_tags = dict()
         if not tags:
-            ret, local_tags = self.get_local_tags()
-            if len(local_tags) == 0:
-                ret = 0
+            _, local_tags = self.get_local_tags()
         elif isinstance(tags, (list, tuple)):
             for tag in tags:
                 local_tags[tag] = None
         else:
             local_tags[tags] = None
 
+        if tags and force:
+            # resolve the SHA-1 of named tags in memory
+            self.load_local_refs()
+
         if not (tags or patterns
                 or GitProject.has_name_changes(
                     local_tags.keys(), options.fullname)
                 or self.pattern.has_category(GitProject.CATEGORY_TAGS)
                 or self.pattern.can_replace(
                     GitProject.CATEGORY_TAGS, local_tags.keys())):
-            cargs = GitProject._push_args(
-                list(), options.extra,
-                '%srefs/tags/*:refs/tags/%s*' % (
-                    '+' if force else '', refs),
-                *args)
-
-            return self.push(self.remote, *cargs, **kws)
+            return ['%srefs/tags/*:refs/tags/%s*' % (
+                '+' if force else '', refs)]
 
         trefs = list()
         for origin, lsha1 in local_tags.items():
@@ -467,9 +852,10 @@ class GitProject(Project, GitCommand):
                     sha1 = remote_tags[remote_tag]
                     if lsha1 is None:
                         if not origin.startswith('refs'):
-                            ret, lsha1 = self.rev_parse('refs/tags/%s' % origin)
+                            _, lsha1 = self.resolve_rev(
+                                'refs/tags/%s' % origin)
                         else:
-                            ret, lsha1 = self.rev_parse(origin)
+                            _, lsha1 = self.resolve_rev(origin)
 
                     equals = _sha1_equals(sha1, lsha1)
 
@@ -480,9 +866,20 @@ class GitProject(Project, GitCommand):
             trefs.append('%srefs/tags/%s:%s' % (
                 '+' if force else '', origin, remote_tag))
 
+        return trefs
+
+    def push_tags(self, tags=None, refs=None, patterns=None, force=False,
+                  options=None, logger=None, *args, **kws):
+        if not logger:
+            logger = Logger.get_logger()
+
+        ret, remote_tags = self.get_remote_tags()
+
+        trefs = self.tags_refspecs(
+            tags, refs, patterns, force=force, options=options,
+            logger=logger, remote_tags=remote_tags)
         if trefs:
-            cargs = GitProject._push_args(list(), options.extra, *trefs)
-            ret = self.push(self.remote, *cargs, **kws)
+            ret = self.push_refspecs(trefs, options, *args, **kws)
 
         if ret != 0 and trefs:
             logger.error(
@@ -490,6 +887,180 @@ class GitProject(Project, GitCommand):
 
         return ret
 
+    def refs_refspecs(self, heads=None, tags=None, logger=None,
+                      remote_refs=None):
+        """Returns the refspecs to push the heads and tags together.
+
+        "heads" and "tags" are the keywords of heads_refspecs() and
+        tags_refspecs(), either could be None not to push. The remote refs
+        should have been listed as the snapshot unless "remote_refs" is
+        set."""
+        refs = remote_refs or self.remote_refs or dict()
+        remote_heads = GitProject._filter_refs(refs, 'refs/heads/')
+        remote_tags = GitProject._filter_refs(refs, 'refs/tags/')
+
+        refspecs = list()
+        if heads is not None:
+            refspecs.extend(self.heads_refspecs(
+                logger=logger, remote_heads=remote_heads,
+                remote_tags=remote_tags, **heads))
+        if tags is not None:
+            refspecs.extend(self.tags_refspecs(
+                logger=logger, remote_tags=remote_tags, **tags))
+
+        return refspecs
+
+    def _inventory_refspecs(self, heads=None, tags=None, logger=None):
+        """Returns the refspecs decided by the heads inventory, or None if
+        the remote refs have to be listed.
+
+        The inventory is enough only if each refspec is a wildcard, which is
+        pushed regardless of the remote, or a head of the listed branches."""
+        if self.heads_inventory is None or \
+                self._load_cached_remote_refs() is not None:
+            return None
+
+        branches, remote_heads = self.heads_inventory
+        refspecs = self.refs_refspecs(
+            heads, tags, logger=logger, remote_refs=remote_heads)
+        for refspec in refspecs:
+            src, _, dest = refspec.lstrip('+').partition(':')
+            if src.endswith('/*') and dest.endswith('*'):
+                continue
+            elif not dest.startswith('refs/heads/') or \
+                    dest[len('refs/heads/'):] not in branches:
+                return None
+
+        return refspecs
+
+    def push_refs(self, heads=None, tags=None, logger=None, *args, **kws):
+        """Pushes the heads and tags with a single "git push".
+
+        The connection, the ref negotiation and the pack are shared instead
+        of pushing the heads and tags separately. The push options are taken
+        from "heads" prior to "tags"."""
+        if not logger:
+            logger = Logger.get_logger()
+
+        ret, refspecs = 0, self._inventory_refspecs(heads, tags, logger)
+        if refspecs is None:
+            ret, _ = self.get_remote_refs()
+            refspecs = self.refs_refspecs(heads, tags, logger=logger)
+
+        if refspecs:
+            ret = self.push_refspecs(
+                refspecs, (heads or tags).get('options'), *args, **kws)
+
+        if ret != 0:
+            logger.error('error to execute git push to %s', self.remote)
+
+        return ret
+
+    def push_in_loop(self, loop, heads=None, tags=None, callback=None,
+                     logger=None, *args, **kws):
+        """Submits to push the heads and tags into the CommandLoop.
+
+        "heads" and "tags" are the same as push_refs(). The remote refs are
+        listed once unless the snapshot exists or the heads inventory is
+        enough, and the heads and tags are pushed together. "callback" is
+        invoked with the final return code."""
+        if not logger:
+            logger = Logger.get_logger()
+
+        def _pushed(refspecs):
+            def _done(ret, _):
+                if ret == 0 and not kws.get('dryrun'):
+                    self._update_remote_refs(refspecs)
+                elif ret:
+                    self.invalidate_remote_refs()
+                    logger.error(
+                        'error to execute git push to %s', self.remote)
+
+                if callback:
+                    callback(ret)
+
+            return _done
+
+        def _push(ret=0, output=None, refspecs=None):
+            if ret == 0 and output is not None:
+                self.set_remote_refs(
+                    GitProject._parse_ls_remote(output.split('\n')))
+
+            if refspecs is None:
+                refspecs = self.refs_refspecs(heads, tags, logger=logger)
+
+            if refspecs:
+                self.push_refspecs(
+                    refspecs, (heads or tags).get('options'), loop=loop,
+                    callback=_pushed(refspecs), *args, **kws)
+            elif callback:
+                callback(0)
+
+        refspecs = self._inventory_refspecs(heads, tags, logger)
+        if heads is None and tags is None:
+            if callback:
+                callback(0)
+        elif refspecs is not None:
+            _push(refspecs=refspecs)
+        elif self._load_cached_remote_refs() is None:
+            self.raw_command(
+                'ls-remote', '--heads', '--tags', self.remote, notdir=True,
+                capture_stdout=True, loop=loop, callback=_push)
+        else:
+            _push()
+
+    def fetch_mirror(self, url, logger=None, refs=None, *args, **kws):
+        """Updates the heads and tags of the bare mirror from "url" and
+        returns the return code with whether anything is fetched.
+
+        The upstream refs are listed with ls-remote and compared with the
+        local refs first, the mirror is fetched only if they are different.
+        If "refs" is set, like the refs of the events, only they are fetched
+        without listing. The missing mirror is initialized before
+        fetching."""
+        logger = logger or Logger.get_logger()
+
+        if refs:
+            if not (self.exists_() and os.listdir(self.gitdir)):
+                ret = self.init(True, self.gitdir)
+                if ret != 0:
+                    return ret, False
+
+            logger.info('Fetch %s from %s', ', '.join(refs), url)
+            ret = GitCommand.fetch(
+                self, '--update-head-ok', url,
+                *(['+%s:%s' % (ref, ref) for ref in refs] + list(args)),
+                **kws)
+            self.invalidate_local_refs()
+
+            return ret, ret == 0
+
+        ret, upstream = self.get_remote_refs(url)
+        if ret != 0:
+            return ret, False
+
+        if self.exists_() and os.listdir(self.gitdir):
+            self.load_local_refs()
+            local = dict(
+                (ref, sha1) for ref, sha1 in (self.local_refs or {}).items()
+                if ref.startswith(('refs/heads/', 'refs/tags/')))
+            if local == upstream:
+                logger.info('upstream refs are unchanged, skip fetching')
+                return 0, False
+        else:
+            ret = self.init(True, self.gitdir)
+            if ret != 0:
+                return ret, False
+
+        logger.info('Fetch %s', url)
+        ret = GitCommand.fetch(
+            self, '--prune', '--update-head-ok', url,
+            '+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*',
+            *args, **kws)
+        self.invalidate_local_refs()
+
+        return ret, ret == 0
+
     def init_or_download(self, revision='master', single_branch=True,
                          offsite=False, reference=None):
         logger = Logger.get_logger()
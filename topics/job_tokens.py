@@ -0,0 +1,65 @@
+import contextlib
+import threading
+
+
+class JobTokens(object):
+    """Shares a budget of jobs among the threads of the process like the
+    jobserver of make.
+
+    The thread running a task holds a token implicitly, which is inherited
+    by the first worker of a nested WorkerPool, the other workers take a
+    token from the budget for each task. So the nested sub-commands and
+    "repo sync" can't overcommit the host but always progress with the
+    inherited token."""
+
+    TOKENS = None
+
+    def __init__(self, budget):
+        self.budget = budget if budget > 0 else 1
+        # the token of the main thread is implicit
+        self.sem = threading.Semaphore(self.budget - 1)
+
+    @staticmethod
+    def build(options):
+        if options.job_budget and JobTokens.TOKENS is None:
+            JobTokens.TOKENS = JobTokens(options.job_budget)
+
+        return JobTokens.TOKENS
+
+    @staticmethod
+    def get():
+        return JobTokens.TOKENS
+
+    def acquire(self, blocking=True):
+        return self.sem.acquire(blocking)
+
+    def acquire_many(self, count):
+        """Takes no more than "count" tokens without blocking and returns
+        the number taken."""
+        taken = 0
+        while taken < count and self.sem.acquire(False):
+            taken += 1
+
+        return taken
+
+    def release(self, count=1):
+        for _ in range(count):
+            self.sem.release()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def lend():
+        """Returns the token held by the thread to the budget if it's built
+        while the thread waits for the others, and takes one again at the
+        end."""
+        tokens = JobTokens.TOKENS
+        if tokens is not None:
+            tokens.release()
+        try:
+            yield
+        finally:
+            if tokens is not None:
+                tokens.acquire()
+
+
+TOPIC_ENTRY = 'JobTokens'
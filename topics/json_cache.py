@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from logger import Logger
+
+
+class JsonCache(object):
+    """Saves the entries as JSON files in a directory across the runs.
+
+    Each key is saved in a file named by its digest with the time it was
+    saved, the entry is fresh until "ttl" seconds passed. The files are
+    replaced by renaming so that the readers never see a broken one."""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.RLock()
+
+    def _filename(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+        return os.path.join(self.path, '%s.json' % digest)
+
+    def load(self, key):
+        """Returns the saved entry of the key or None."""
+        filename = self._filename(key)
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as fp:
+                    entry = json.load(fp)
+
+                # the key is saved as "url" to read the files of the earlier
+                # versions
+                if entry.get('url') == key:
+                    return entry
+            except (IOError, OSError, ValueError) as e:
+                Logger.get_logger().debug('%s: %s', filename, e)
+
+        return None
+
+    def load_fresh(self, key):
+        """Returns the entry of the key or None if it's missing or
+        expired."""
+        entry = self.load(key)
+        if entry and time.time() - entry.get('timestamp', 0) < self.ttl:
+            return entry
+
+        return None
+
+    def save(self, key, timestamp=None, **values):
+        """Saves the values of the key with the time, which is now unless
+        "timestamp" is set."""
+        with self.lock:
+            if not os.path.exists(self.path):
+                try:
+                    os.makedirs(self.path)
+                except OSError:
+                    # created by another process
+                    pass
+
+            # write to a temporary file and rename not to leave a broken one
+            fd, tmpname = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(dict(
+                    values, url=key,
+                    timestamp=time.time() if timestamp is None
+                    else timestamp), fp)
+
+            os.rename(tmpname, self._filename(key))
+
+    def touch(self, key, **values):
+        """Saves the values of the existed key with its saved time not to
+        extend the expiration."""
+        with self.lock:
+            entry = self.load(key)
+            if entry:
+                self.save(key, entry.get('timestamp', 0), **values)
+
+    def remove(self, key):
+        filename = self._filename(key)
+        if os.path.exists(filename):
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+
+
+TOPIC_ENTRY = 'JsonCache'
@@ -10,11 +10,19 @@ fetch the supported attributes.
 
 import contextlib
 import os
+import re
 import sys
 import xml.dom.minidom
 
+try:
+    from urllib.parse import urljoin
+except ImportError:
+    from urlparse import urljoin
+
 from collections import namedtuple
 
+from files.file_utils import FileUtils
+
 
 def _attr(node, attribute, default=None):
     attr = node.getAttribute(attribute)
@@ -167,9 +175,12 @@ be saved in XML file again with limited attributes.
 
     DEFAULT_MANIFEST = 'manifest.xml'
 
-    def __init__(self, filename=None, refspath=None, mirror=False):
+    def __init__(self, filename=None, refspath=None, mirror=False,
+                 basedir=None):
         self.mirror = mirror
         self.refspath = refspath
+        # the directory to resolve the relative filename
+        self.basedir = basedir
         self._default = None
         self._remote = dict()
         self._projects = list()
@@ -306,7 +317,9 @@ be saved in XML file again with limited attributes.
                     self._projects[name].set_removed(True)
 
     def _load(self, filename):
-        fp = filename or os.path.join('.repo', Manifest.DEFAULT_MANIFEST)
+        fp = FileUtils.absolute_path(
+            filename or os.path.join('.repo', Manifest.DEFAULT_MANIFEST),
+            self.basedir)
         nodes = self._parse_manifest_xml(fp)
         self._parse_manifest(nodes)
 
@@ -341,6 +354,33 @@ be saved in XML file again with limited attributes.
     def get_remotes(self):
         return self._remote.values()
 
+    def get_fetch_url(self, remote):
+        """Returns the fetch url of the remote resolved with the location of
+        the manifest like git-repo, the url of a project is followed by its
+        name."""
+        item = self._remote.get(remote or self._default.remote)
+        if item is None:
+            raise ManifestException('remote %s not defined' % remote)
+
+        url = item.fetch.rstrip('/')
+        base = '%s/' % (self.refspath or '').rstrip('/')
+        # urljoin resolves the relative url with the known schemes only,
+        # the others and the scp-like url "host:path" are resolved with a
+        # fake scheme
+        match = re.match(r'([a-zA-Z][a-zA-Z0-9+.-]*://)', base)
+        if match:
+            scheme, base = match.group(1), base[len(match.group(1)):]
+        elif base.find(':') != base.find('/') - 1:
+            scheme = ''
+        else:
+            return urljoin(base, url).rstrip('/')
+
+        url = urljoin('gopher://' + base, url)
+        if url.startswith('gopher://'):
+            url = scheme + url[len('gopher://'):]
+
+        return url.rstrip('/')
+
     def get_projects(self, raw=False):
         projects = [
             project for project in self._projects if not project.removed]
@@ -450,7 +490,8 @@ store the live manifest nodes into files.
                 if fp is not sys.stdout:
                     fp.close()
 
-        with _open(self.filename, 'w') as filep:
+        with _open(self.filename and FileUtils.absolute_path(self.filename),
+                   'w') as filep:
             doc = self.xml()
             doc.writexml(filep, '', '  ', '\n', 'utf-8')
 
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class MirrorState(object):
+    """Records the local refs pushed to the remote in a SQLite database.
+
+    The database is saved as ".krep/mirror-state.db" in the working
+    directory. Each project and remote keeps the ref-to-SHA-1 map of the last
+    successful push with its fingerprint, a project can be skipped without
+    contacting the remote if its local refs have the same fingerprint."""
+
+    FILENAME = '.krep/mirror-state.db'
+    # the options deciding the pushed refs besides the local refs
+    PUSH_OPTIONS = (
+        'refs', 'head_refs', 'tag_refs', 'head_pattern', 'tag_pattern',
+        'keep_name', 'all', 'heads', 'branches', 'tags', 'sha1_tag',
+        'pattern', 'pattern_file')
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--force') or \
+            optparse.add_option_group('Other options')
+        options.add_option(
+            '--skip-unchanged',
+            dest='skip_unchanged', action='store_true',
+            help='Skip the projects whose local refs are unchanged since the '
+                 'last successful push, which is recorded in the working '
+                 'directory')
+
+    def __init__(self, filename):
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        with self.lock:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                'project TEXT, remote TEXT, fingerprint TEXT, refs TEXT, '
+                'timestamp REAL, PRIMARY KEY (project, remote))')
+            self.conn.commit()
+
+    @staticmethod
+    def build(options, working_dir):
+        if options.skip_unchanged:
+            return MirrorState(os.path.join(working_dir, MirrorState.FILENAME))
+        else:
+            return None
+
+    @staticmethod
+    def fingerprint(refs, *extras):
+        """Returns the digest of the refs and the extra values, which are the
+        options to decide the pushed refs."""
+        digest = hashlib.sha1()
+        for ref in sorted(refs or dict()):
+            digest.update(('%s %s\n' % (refs[ref], ref)).encode('utf-8'))
+
+        for extra in extras:
+            digest.update(('%r\n' % (extra,)).encode('utf-8'))
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def extras(options, *values):
+        """Returns "values" with the push options as the extra values of the
+        fingerprint, the missing options of a sub-command are None."""
+        return values + tuple(
+            getattr(options, name) for name in MirrorState.PUSH_OPTIONS)
+
+    def _get(self, project, remote):
+        with self.lock:
+            cursor = self.conn.execute(
+                'SELECT fingerprint, refs FROM state '
+                'WHERE project = ? AND remote = ?', (project, remote))
+
+            return cursor.fetchone()
+
+    def has(self, project, remote):
+        return self._get(project, remote) is not None
+
+    def get_refs(self, project, remote):
+        row = self._get(project, remote)
+
+        return json.loads(row[1]) if row else dict()
+
+    def unchanged(self, project, remote, refs, *extras):
+        row = self._get(project, remote)
+
+        return row is not None and \
+            row[0] == MirrorState.fingerprint(refs, *extras)
+
+    def save(self, project, remote, refs, *extras):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO state '
+                '(project, remote, fingerprint, refs, timestamp) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (project, remote, MirrorState.fingerprint(refs, *extras),
+                 json.dumps(refs), time.time()))
+            self.conn.commit()
+
+    def remove(self, project, remote):
+        with self.lock:
+            self.conn.execute(
+                'DELETE FROM state WHERE project = ? AND remote = ?',
+                (project, remote))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+TOPIC_ENTRY = 'MirrorState'
@@ -0,0 +1,67 @@
+import threading
+import time
+
+
+class PollSchedule(object):
+    """Schedules the polling of the projects with adaptive intervals.
+
+    A project starts with "min_interval" seconds. The interval is doubled
+    each time the project is polled unchanged until "max_interval", and
+    reset to "min_interval" once it's changed. So the active projects are
+    polled in minutes while the dormant ones are rarely contacted. A failed
+    poll keeps the interval."""
+
+    def __init__(self, min_interval=60, max_interval=3600):
+        self.min_interval = max(min_interval or 0, 1)
+        self.max_interval = max(max_interval or 0, self.min_interval)
+        self.lock = threading.Lock()
+        # the interval and the next time to poll of the projects
+        self.entries = dict()
+
+    def due(self, keys, now=None):
+        """Returns the keys to poll at the time, the unknown keys are due
+        at once."""
+        now = now or time.time()
+        with self.lock:
+            return [
+                key for key in keys
+                if key not in self.entries or self.entries[key][1] <= now]
+
+    def update(self, key, changed, now=None):
+        """Schedules the next poll of the key by whether it's changed, or
+        None if the poll failed."""
+        now = now or time.time()
+        with self.lock:
+            interval = self.entries.get(key, (self.min_interval, 0))[0]
+            if changed:
+                interval = self.min_interval
+            elif changed is not None:
+                interval = min(interval * 2, self.max_interval)
+
+            self.entries[key] = (interval, now + interval)
+
+            return interval
+
+    def retain(self, keys):
+        """Forgets the keys not in "keys", like the removed projects."""
+        keys = set(keys)
+        with self.lock:
+            for key in list(self.entries):
+                if key not in keys:
+                    del self.entries[key]
+
+    def next_time(self, keys):
+        """Returns the earliest time to poll any of the keys."""
+        with self.lock:
+            times = [
+                self.entries[key][1] if key in self.entries else 0
+                for key in keys]
+
+        return min(times) if times else None
+
+    def get_interval(self, key):
+        with self.lock:
+            return self.entries.get(key, (self.min_interval, 0))[0]
+
+
+TOPIC_ENTRY = 'PollSchedule'
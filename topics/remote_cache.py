@@ -0,0 +1,55 @@
+import os
+
+from json_cache import JsonCache
+
+
+class RemoteRefCache(JsonCache):
+    """Caches the remote refs listed by ls-remote across the runs.
+
+    Each remote url is saved as a JSON file in the directory ".krep" of the
+    working directory with the time it was listed. The refs are reused until
+    the TTL expires and updated with the results of the pushes, so that an
+    unchanged project needn't contact the remote in the following runs."""
+
+    DIRECTORY = '.krep/remote-refs'
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--refs') or \
+            optparse.add_option_group('Remote options')
+        options.add_option(
+            '--remote-cache-ttl',
+            dest='remote_cache_ttl', action='store', type='int',
+            metavar='SECONDS',
+            help='Cache the refs of the remote repositories in the working '
+                 'directory and reuse them in the seconds instead of running '
+                 'ls-remote. It is disabled by default')
+
+    @staticmethod
+    def build(options, working_dir):
+        if options.remote_cache_ttl and options.remote_cache_ttl > 0:
+            return RemoteRefCache(
+                os.path.join(working_dir, RemoteRefCache.DIRECTORY),
+                options.remote_cache_ttl)
+        else:
+            return None
+
+    def get(self, url):
+        """Returns the cached refs or None if it's missing or expired."""
+        entry = self.load_fresh(url)
+        if entry:
+            return dict(entry.get('refs') or dict())
+
+        return None
+
+    def set(self, url, refs):
+        """Saves the refs just listed from the remote."""
+        self.save(url, refs=refs)
+
+    def update(self, url, refs):
+        """Saves the refs updated by the push, the listing time is kept not to
+        extend the expiration."""
+        self.touch(url, refs=refs)
+
+
+TOPIC_ENTRY = 'RemoteRefCache'
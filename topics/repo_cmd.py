@@ -1,10 +1,17 @@
 
+import re
+import threading
+
 from command import Command
 from files.file_utils import FileUtils
 
 
 class RepoCommand(Command):
     """Executes a repo sub-command with specified parameters"""
+    # the options of the sub-commands read from the help of repo
+    OPTIONS = dict()
+    LOCK = threading.Lock()
+
     def __init__(self, *args, **kws):
         Command.__init__(self, *args, **kws)
         self.repo = FileUtils.find_execute('repo')
@@ -19,8 +26,22 @@ class RepoCommand(Command):
         self.new_args(cli, self.get_args())
         return self.wait(**kws)
 
+    def has_option(self, subcmd, option):
+        """Returns true if the sub-command of the installed repo supports
+        the option, the help of the sub-command is read once."""
+        with RepoCommand.LOCK:
+            if subcmd not in RepoCommand.OPTIONS:
+                command = Command(cwd=self.cwd)
+                command.new_args(self.repo, 'help', subcmd)
+                command.wait(capture_stdout=True)
+                RepoCommand.OPTIONS[subcmd] = set(
+                    re.findall(r'--[\w-]+', command.get_output()))
+
+            return option in RepoCommand.OPTIONS[subcmd]
+
     def init(self, *args, **kws):
         return self._execute('init', *args, **kws)
 
     def sync(self, *args, **kws):
+        kws.setdefault('command_class', 'fetch')
         return self._execute('sync', *args, **kws)
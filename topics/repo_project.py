@@ -1,6 +1,7 @@
 
 import os
 
+from job_tokens import JobTokens
 from repo_cmd import RepoCommand
 from project import Project
 
@@ -92,12 +93,21 @@ class RepoProject(Project, RepoCommand):
 
         self.add_args('--force-sync', condition=force_sync)
 
-        if opts.jobs:
-            self.add_args(opts.jobs, before='-j')
-        else:
-            self.add_args(self.options.job, before='-j')
-
-        return RepoCommand.sync(self, *args, **kws)
+        jobs = opts.jobs or self.options.job
+        tokens = JobTokens.get()
+        if tokens is None:
+            self.add_args(jobs, before='-j')
+            # count the jobs of repo by the governor of the processes
+            return RepoCommand.sync(
+                self, slots=int(jobs or 1), *args, **kws)
+
+        # take the tokens besides the inherited one for the jobs of repo
+        taken = tokens.acquire_many(int(jobs or 1) - 1)
+        try:
+            self.add_args(taken + 1, before='-j')
+            return RepoCommand.sync(self, slots=taken + 1, *args, **kws)
+        finally:
+            tokens.release(taken)
 
 
 TOPIC_ENTRY = "RepoProject"
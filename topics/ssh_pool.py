@@ -0,0 +1,187 @@
+import atexit
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+from files.file_utils import FileUtils
+from logger import Logger
+
+
+class SshPool(object):
+    """Shares the ssh connections with the ControlMaster of OpenSSH.
+
+    A master is started for each host:port by the first ssh command and
+    the following commands run as the sessions of it without the key
+    exchange and the authentication. The gerrit commands run with the ssh
+    options directly and the git commands with GIT_SSH_COMMAND.
+
+    No more than "max_sessions" sessions, which should be the MaxSessions of
+    the server, run on a master at the same time. The sessions are counted
+    for each host:port, and more masters to the host:port are started if
+    more sessions are running. A streamed command holds its session until
+    the output is exhausted, and a command of the loop until its callback.
+    All masters are exited once krep exits."""
+
+    POOL = None
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--refs') or \
+            optparse.add_option_group('Remote options')
+        options.add_option(
+            '--ssh-multiplex',
+            dest='ssh_multiplex', action='store_true',
+            help='Share the ssh connections to the same host with the '
+                 'ControlMaster of OpenSSH')
+        options.add_option(
+            '--ssh-max-sessions',
+            dest='ssh_max_sessions', action='store', type='int', default=10,
+            metavar='SESSIONS',
+            help='Set the sessions shared by a ssh connection, which '
+                 'shouldn\'t exceed MaxSessions of the ssh server: %default')
+
+    def __init__(self, max_sessions=10, persist=600):
+        self.max_sessions = max_sessions if max_sessions > 0 else 1
+        self.persist = persist
+        self.directory = tempfile.mkdtemp(prefix='krep-ssh-')
+        self.ssh = FileUtils.find_execute('ssh')
+
+        self.lock = threading.Lock()
+        # the running sessions of the masters of each host:port
+        self.sessions = dict()
+
+    @staticmethod
+    def build(options):
+        if options.ssh_multiplex and SshPool.POOL is None:
+            SshPool.POOL = SshPool(options.ssh_max_sessions)
+            atexit.register(SshPool.POOL.close)
+
+        return SshPool.POOL
+
+    @staticmethod
+    def get():
+        return SshPool.POOL
+
+    @staticmethod
+    def get_key(url):
+        """Returns "host:port" of the ssh url, or None for the other urls."""
+        if not url:
+            return None
+
+        if '://' in url:
+            ulp = urlparse(url)
+            if ulp.scheme not in ('ssh', 'git+ssh', 'ssh+git') or \
+                    not ulp.hostname:
+                return None
+
+            return '%s:%d' % (ulp.hostname, ulp.port or 22)
+
+        # the scp-like syntax "[user@]host:path"
+        match = re.match(r'^(?:[^@/]+@)?([^:/]{2,}):', url)
+        if match:
+            return '%s:22' % match.group(1)
+
+        return None
+
+    def acquire(self, key):
+        """Takes a session on a master of the host:port and returns the
+        handle to release it."""
+        with self.lock:
+            sessions = self.sessions.setdefault(key, list())
+            for index, count in enumerate(sessions):
+                if count < self.max_sessions:
+                    sessions[index] += 1
+                    return key, index
+
+            sessions.append(1)
+            return key, len(sessions) - 1
+
+    def release(self, handle):
+        key, index = handle
+        with self.lock:
+            self.sessions[key][index] -= 1
+
+    def counts(self, key):
+        """Returns the running sessions of each master of the host:port."""
+        with self.lock:
+            return list(self.sessions.get(key) or list())
+
+    def ssh_options(self, handle):
+        # %C is the hash of the local host, remote host, port and user
+        return [
+            '-o', 'ControlMaster=auto',
+            '-o', 'ControlPath=%s' % os.path.join(
+                self.directory, '%d-%%C' % handle[1]),
+            '-o', 'ControlPersist=%d' % self.persist]
+
+    def _hold(self, lines, handle):
+        try:
+            for line in lines:
+                yield line
+        finally:
+            self.release(handle)
+
+    def dispatch(self, key, dispatch, **kws):
+        """Runs "dispatch(ssh_options, **kws)" in a session of the master of
+        the host:port. The session is held until the lines are read for
+        "stream", or the callback is invoked for "loop"."""
+        handle = self.acquire(key)
+        if kws.get('loop') is not None:
+            callback = kws.get('callback')
+
+            def _done(*args):
+                self.release(handle)
+                if callback:
+                    callback(*args)
+
+            kws['callback'] = _done
+
+        try:
+            result = dispatch(self.ssh_options(handle), **kws)
+        except:  # pylint: disable=W0702
+            self.release(handle)
+            raise
+
+        if kws.get('loop') is not None:
+            return result
+        elif kws.get('stream'):
+            return self._hold(result, handle)
+
+        self.release(handle)
+
+        return result
+
+    @staticmethod
+    def git_ssh_command(options, command=None):
+        """Returns GIT_SSH_COMMAND running "command", ssh by default, with
+        the ssh options."""
+        return ' '.join([command or 'ssh'] + options)
+
+    def close(self):
+        logger = Logger.get_logger()
+
+        if not os.path.isdir(self.directory):
+            return
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            logger.debug('exit ssh master %s', path)
+            # the host is ignored with the explicit control path
+            with open(os.devnull, 'w') as null:
+                subprocess.call(
+                    [self.ssh, '-o', 'ControlPath=%s' % path, '-O', 'exit',
+                     'localhost'],
+                    stdout=null, stderr=subprocess.STDOUT)
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+TOPIC_ENTRY = 'SshPool'
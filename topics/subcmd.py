@@ -1,14 +1,17 @@
 
 import os
-import threading
 
-from command import Command
+from command import Command, CommandGovernor
 from config_file import XmlConfigFile
 from error import HookError
+from files.file_utils import FileUtils
 from git_pattern import GitPattern
+from job_tokens import JobTokens
 from logger import Logger
 from options import Values
 from pattern_file import PatternFile as XmlPatternFile
+from ssh_pool import SshPool
+from worker_pool import WorkerPool
 
 
 class KrepXmlConfigFile(XmlPatternFile):
@@ -139,6 +142,51 @@ class SubCommand(object):
                 '-j', '--job',
                 dest='job', action='store', type='int',
                 help='jobs to run with specified threads in parallel')
+            options.add_option(
+                '--job-budget',
+                dest='job_budget', action='store', type='int',
+                metavar='JOBS',
+                help='Limit the jobs running at the same time in the whole '
+                     'process, which are shared by the nested sub-commands '
+                     'and "repo sync". It is unlimited by default')
+            options.add_option(
+                '--max-processes',
+                dest='max_processes', action='store', type='int',
+                metavar='PROCESSES',
+                help='Limit the child processes running at the same time '
+                     'in the whole process, including "repo sync" and the '
+                     'hooks. It is unlimited by default')
+            options.add_option(
+                '--process-limit',
+                dest='process_limit', action='append',
+                metavar='CLASS=PROCESSES',
+                help='Limit the child processes of a class running at the '
+                     'same time, the class is one of "fetch", "push", '
+                     '"ssh" and "local"')
+            options.add_option(
+                '--task-timeout',
+                dest='task_timeout', action='store', type='float',
+                metavar='SECONDS',
+                help='Kill the commands of a task running longer than the '
+                     'seconds and fail the task without stopping the others')
+            options.add_option(
+                '--task-retries',
+                dest='task_retries', action='store', type='int',
+                metavar='TIMES',
+                help='Retry a task timed out or failed with a transient '
+                     'network error for the times, default: 0')
+            options.add_option(
+                '--retry-backoff',
+                dest='retry_backoff', action='store', type='float',
+                metavar='SECONDS',
+                help='Wait the seconds before the first retry of a task, '
+                     'which are doubled for each retry, default: %s'
+                     % WorkerPool.BACKOFF)
+            options.add_option(
+                '--keep-going',
+                dest='keep_going', action='store_true',
+                help='Continue the other tasks if a task raised an error '
+                     'and report the failed tasks at the end')
 
     def _option_extra(self, optparse, extra_list=None):
         def _format_list(extra_items):
@@ -233,7 +281,7 @@ class SubCommand(object):
         else:
             path = options.working_dir
 
-        return os.path.expanduser(path)
+        return FileUtils.absolute_path(path)
 
     @staticmethod
     def get_absolute_running_file_name(options, filename):
@@ -331,6 +379,12 @@ class SubCommand(object):
     def execute(self, options, *args, **kws):  # pylint: disable=W0613
         # set the logger name at the beggining
         self.get_logger(self.get_name(options))
+        # share the ssh connections if it's enabled
+        SshPool.build(options)
+        # share the jobs with the nested sub-commands if it's limited
+        JobTokens.build(options)
+        # limit the child processes of the whole process
+        CommandGovernor.build(options)
 
         return True
 
@@ -340,50 +394,126 @@ class SubCommandWithThread(SubCommand):
     def support_jobs(self):  # pylint: disable=W0613
         return True
 
-    def run_with_thread(self, jobs, tasks, func, *args):
-        def _run(task, sem, event, func, args):
-            try:
-                if len(args) > 0:
-                    func(task, *args)
-                else:
-                    func(task)
-            except KeyboardInterrupt:
-                if event:
-                    event.set()
-            except Exception as e:  # pylint: disable=W0703
-                self.get_logger().exception(e)
-                event.set()
-            finally:
-                sem.release()
-
-        ret = True
-        if jobs and jobs > 1:
-            threads = set()
-            sem = threading.Semaphore(jobs)
-            event = threading.Event()
-
-            for task in tasks:
-                if event.isSet():
-                    break
-
-                sem.acquire()
-                thread = threading.Thread(
-                    target=_run,
-                    args=(task, sem, event, func, args))
-                threads.add(thread)
-                thread.start()
-
-            for thread in threads:
-                thread.join()
-
-            if event.isSet():
-                self.get_logger().error('Exited due to errors')
-                ret = False
-        else:
-            for task in tasks:
-                ret = func(task, *args) and ret
+    def run_tasks(self, jobs, tasks, func, *args, **kws):
+        """Runs func(task, *args) with "jobs" workers and returns the list of
+        TaskResult with the return values, exceptions and timings.
+
+        The tasks are scheduled by the expected cost if TaskHistory is set
+        with the keyword "history", which records the timings then. The
+        timeout, the retries and the error handling are read from the
+        keyword "options"."""
+        history = kws.get('history')
+        with WorkerPool(
+                jobs, history and history.cost,
+                **SubCommandWithThread._get_policy(kws)) as pool:
+            results = pool.run(tasks, func, *args)
+
+        self._record_results(results, history)
+
+        return results
+
+    def run_pipeline(self, jobs, tasks, fetch, push, *args, **kws):
+        """Runs fetch(task) and push(task, *args) as two stages and returns
+        the list of TaskResult of the tasks.
 
-        return ret
+        A task enters the push stage as soon as its fetch returns true. The
+        stages run with "fetch_jobs" and "jobs" workers, no more than
+        "depth" fetched tasks wait for the push stage, which blocks the
+        fetch stage. The failed fetches are returned as the results.
 
+        Only the fetch stage inherits the token of the caller, the threads
+        waiting for the push stage lend their tokens to it."""
+        history = kws.get('history')
+        depth = kws.get('depth') or jobs
+
+        policy = SubCommandWithThread._get_policy(kws)
+        with WorkerPool(jobs, depth=depth, inherit=False, **policy) as pusher:
+            pushes = dict()
+
+            def _fetch(task):
+                if pusher.is_aborted():
+                    return False
+
+                ret = fetch(task)
+                if ret:
+                    # blocked once the push stage is full
+                    with JobTokens.lend():
+                        pushes[id(task)] = pusher.submit(task, push, *args)
+
+                return ret
+
+            with WorkerPool(
+                    kws.get('fetch_jobs') or jobs,
+                    history and history.cost, **policy) as fetcher:
+                fetches = fetcher.run(tasks, _fetch)
+
+            with JobTokens.lend():
+                pusher.wait()
+
+        results = list()
+        for result in fetches:
+            if id(result.task) in pushes:
+                # count the time of both stages for the task
+                pushes[id(result.task)].elapsed += result.elapsed
+                result = pushes[id(result.task)]
+
+            results.append(result)
+
+        self._record_results(results, history)
+
+        return results
+
+    @staticmethod
+    def _get_policy(kws):
+        options = kws.get('options')
+
+        return WorkerPool.policy(options) if options is not None else dict()
+
+    def _record_results(self, results, history=None):
+        logger = self.get_logger()
+        for result in results:
+            if not result.skipped:
+                logger.debug('%s: %.2fs', result.task, result.elapsed)
+
+        governor = CommandGovernor.get()
+        if governor is not None:
+            logger.debug('peak processes: %s', governor.get_peaks())
+
+        if history is not None:
+            history.record(results)
+
+    def _report_results(self, results):
+        logger = self.get_logger()
+        if any(result.exception is not None for result in results):
+            logger.error('Exited due to errors')
+
+        retried = [result for result in results if result.attempts > 1]
+        if retried:
+            logger.info(
+                '%d tasks retried, %d of them succeeded', len(retried),
+                len([result for result in retried if result.succeeded()]))
+
+        failures = [result for result in results if not result.succeeded()]
+        if failures:
+            logger.error(
+                '%d of %d tasks failed: %s', len(failures), len(results),
+                ', '.join([str(result.task) for result in failures]))
+            for result in failures:
+                if result.skipped:
+                    continue
+
+                logger.error(
+                    '  %s: %s (%d attempts)', result.task, result.reason(),
+                    result.attempts)
+
+        return not failures
+
+    def run_with_thread(self, jobs, tasks, func, *args, **kws):
+        return self._report_results(
+            self.run_tasks(jobs, tasks, func, *args, **kws))
+
+    def run_with_pipeline(self, jobs, tasks, fetch, push, *args, **kws):
+        return self._report_results(
+            self.run_pipeline(jobs, tasks, fetch, push, *args, **kws))
 
 TOPIC_ENTRY = 'SubCommand, SubCommandWithThread, KrepXmlConfigFile'
@@ -0,0 +1,135 @@
+import json
+import os
+import tempfile
+import threading
+
+from logger import Logger
+
+
+class TaskHistory(object):
+    """Records the duration and the on-disk size of the projects run by the
+    worker pool to schedule the next runs by the expected cost.
+
+    The history is saved as ".krep/task-history.json" in the working
+    directory. A project without the history is estimated from the size of
+    its objects with the throughput of the recorded projects, so that the
+    largest projects start first and won't be left as the stragglers."""
+
+    FILENAME = '.krep/task-history.json'
+    # the throughput assumed without any history, in bytes per second
+    DEFAULT_THROUGHPUT = 10 * 1024 * 1024
+    # the weight of the latest duration against the recorded one
+    WEIGHT = 0.5
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--force') or \
+            optparse.add_option_group('Other options')
+        options.add_option(
+            '--schedule-by-cost',
+            dest='schedule_by_cost', action='store_true',
+            help='Start the projects with the longest expected duration '
+                 'first, which is recorded in the working directory or '
+                 'estimated from the size of the project')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.sizes = dict()
+        self.throughput = None
+
+        self.entries = dict()
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as fp:
+                    self.entries = json.load(fp)
+            except (IOError, OSError, ValueError) as e:
+                Logger.get_logger().debug('%s: %s', filename, e)
+
+    @staticmethod
+    def build(options, working_dir):
+        if options.schedule_by_cost:
+            return TaskHistory(
+                os.path.join(working_dir, TaskHistory.FILENAME))
+        else:
+            return None
+
+    @staticmethod
+    def _disk_size(task):
+        gitdir = getattr(task, 'gitdir', None)
+        if not gitdir and getattr(task, 'worktree', None):
+            gitdir = os.path.join(task.worktree, '.git')
+
+        size = 0
+        if gitdir:
+            for root, _, files in os.walk(os.path.join(gitdir, 'objects')):
+                for name in files:
+                    try:
+                        size += os.path.getsize(os.path.join(root, name))
+                    except OSError:
+                        pass
+
+        return size
+
+    def size(self, task):
+        key = str(task)
+        with self.lock:
+            if key not in self.sizes:
+                self.sizes[key] = TaskHistory._disk_size(task)
+
+            return self.sizes[key]
+
+    def _get_throughput(self):
+        if self.throughput is None:
+            elapsed, size = 0.0, 0
+            for entry in self.entries.values():
+                if entry.get('elapsed') and entry.get('size'):
+                    elapsed += entry['elapsed']
+                    size += entry['size']
+
+            self.throughput = size / elapsed if elapsed > 0 \
+                else TaskHistory.DEFAULT_THROUGHPUT
+
+        return self.throughput
+
+    def cost(self, task):
+        """Returns the expected seconds to run the task."""
+        entry = self.entries.get(str(task))
+        if entry and entry.get('elapsed') is not None:
+            return entry['elapsed']
+
+        return self.size(task) / float(self._get_throughput())
+
+    def record(self, results):
+        """Records the durations of the succeeded TaskResult and saves the
+        history."""
+        for result in results:
+            if not result.succeeded():
+                continue
+
+            key = str(result.task)
+            elapsed = result.elapsed
+            entry = self.entries.get(key)
+            if entry and entry.get('elapsed') is not None:
+                elapsed = TaskHistory.WEIGHT * elapsed + \
+                    (1 - TaskHistory.WEIGHT) * entry['elapsed']
+
+            self.entries[key] = dict(
+                elapsed=elapsed, size=self.size(result.task))
+
+        self.save()
+
+    def save(self):
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        # write to a temporary file and rename not to leave a broken one
+        fd, tmpname = tempfile.mkstemp(dir=dirname or None)
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(self.entries, fp, indent=2, sort_keys=True)
+
+        os.rename(tmpname, self.filename)
+
+
+TOPIC_ENTRY = 'TaskHistory'
@@ -0,0 +1,302 @@
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from command import Command, CommandTimeoutError
+from dir_utils import BaseDir, get_base_dir
+from job_tokens import JobTokens
+from logger import Logger
+
+
+class TaskResult(object):
+    """Records the return value, the exception and the elapsed seconds of a
+    task run by WorkerPool."""
+
+    def __init__(self, task):
+        self.task = task
+        self.value = None
+        self.exception = None
+        self.elapsed = 0.0
+        # not run as the pool was aborted before it
+        self.skipped = True
+        self.attempts = 0
+        self.timedout = False
+        # failed with a transient error of the network
+        self.transient = False
+
+    def succeeded(self):
+        return not self.skipped and self.exception is None and \
+            bool(self.value)
+
+    def reason(self):
+        if self.skipped:
+            return 'skipped'
+        elif self.timedout:
+            return 'timed out'
+        elif self.exception is not None:
+            return str(self.exception) or type(self.exception).__name__
+        else:
+            return 'failed'
+
+
+class WorkerPool(object):
+    """Runs the tasks with a fixed number of long-lived worker threads.
+
+    The workers are started by the first run() and fed from a queue, they
+    are reused by the following runs until close(). The tasks are run in
+    the calling thread if "jobs" is not more than one. The tasks start in
+    the descending order of "cost", a function returning the expected cost
+    of a task, if it's set.
+
+    The tasks can be submitted one by one as well, the queue holds no more
+    than "depth" tasks if it's set so that the submitter is blocked until
+    the workers catch up.
+
+    Once a task raises an exception, the pool is aborted and the queued
+    tasks are skipped, which matches the previous thread-per-task way,
+    unless "keep_going" is set to run all tasks and report the failures.
+
+    The commands of a task are killed once the task runs for "timeout"
+    seconds. A task timed out or failed with a transient error of the
+    network is queued again after "backoff" seconds, which are doubled for
+    each attempt, until it's retried "retries" times. The workers run the
+    other tasks in the meantime. A timed-out task fails without aborting
+    the pool.
+
+    If JobTokens is built, the workers except the first one take a token
+    for each task from the budget shared by the process. The first one
+    takes a token as well unless "inherit" is set to run with the token of
+    the caller. The tasks run
+    with the base directory of the thread queuing them."""
+
+    # the seconds to wait before the first retry
+    BACKOFF = 5.0
+
+    def __init__(self, jobs=1, cost=None, depth=0,  # pylint: disable=R0913
+                 timeout=None, retries=0, backoff=None, keep_going=False,
+                 inherit=True):
+        self.jobs = jobs if jobs and jobs > 1 else 1
+        self.inherit = inherit
+        self.cost = cost
+        self.queue = queue.Queue(depth if depth and depth > 0 else 0)
+        self.workers = list()
+        self.aborted = threading.Event()
+
+        self.timeout = timeout if timeout and timeout > 0 else None
+        self.retries = retries if retries and retries > 0 else 0
+        self.backoff = backoff if backoff is not None \
+            else WorkerPool.BACKOFF
+        self.keep_going = keep_going
+        # the tasks queued or waiting for the retries
+        self.pending = 0
+        self.cond = threading.Condition()
+        self.timers = list()
+
+    @staticmethod
+    def policy(options):
+        """Returns the keywords of the timeout, the retries and the error
+        handling from the options."""
+        return dict(
+            timeout=options.task_timeout, retries=options.task_retries,
+            backoff=options.retry_backoff, keep_going=options.keep_going)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _start(self):
+        while len(self.workers) < self.jobs:
+            worker = threading.Thread(
+                target=self._work, args=(len(self.workers),))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def _work(self, index):
+        # the first worker runs with the token inherited from the caller
+        tokens = JobTokens.get() if index > 0 or not self.inherit else None
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            result, func, args, base = item
+            retried = False
+            try:
+                if self.aborted.is_set():
+                    continue
+
+                if tokens is not None:
+                    tokens.acquire()
+                try:
+                    with BaseDir(base, create=False):
+                        self._call(result, func, args)
+                finally:
+                    if tokens is not None:
+                        tokens.release()
+
+                retried = self._retry(result, item)
+            finally:
+                if not retried:
+                    self._done()
+
+    def _call(self, result, func, args):
+        start = time.time()
+        result.skipped = False
+        result.attempts += 1
+        result.value, result.exception = None, None
+        previous = Command.begin_task(self.timeout)
+        try:
+            result.value = func(result.task, *args)
+        except KeyboardInterrupt as e:
+            result.exception = e
+            self.aborted.set()
+        except CommandTimeoutError as e:
+            # fail the task only not to stall the others
+            result.exception = e
+        except Exception as e:  # pylint: disable=W0703
+            Logger.get_logger().exception(e)
+            result.exception = e
+        finally:
+            result.transient = Command.end_task(previous)
+            result.timedout = isinstance(
+                result.exception, CommandTimeoutError)
+            result.elapsed += time.time() - start
+
+    def _get_delay(self, result):
+        """Returns the seconds to wait before retrying the task, or None if
+        it shouldn't be retried."""
+        if result.succeeded() or self.aborted.is_set():
+            return None
+
+        if not (result.timedout or result.transient) \
+                or result.attempts > self.retries:
+            if result.exception is not None and not result.timedout \
+                    and not self.keep_going:
+                self.aborted.set()
+
+            return None
+
+        delay = self.backoff * 2 ** (result.attempts - 1)
+        Logger.get_logger().warning(
+            '%s: %s, retry in %.1fs (%d/%d)', result.task,
+            result.reason() if result.timedout else 'transient failure',
+            delay, result.attempts, self.retries)
+
+        return delay
+
+    def _retry(self, result, item):
+        """Queues the failed task again after the backoff, returns False if
+        it isn't retried."""
+        delay = self._get_delay(result)
+        if delay is None:
+            return False
+
+        timer = threading.Timer(delay, self.queue.put, (item,))
+        timer.daemon = True
+        with self.cond:
+            self.timers.append(timer)
+        timer.start()
+
+        return True
+
+    def _add(self, item):
+        with self.cond:
+            self.pending += 1
+        self.queue.put(item)
+
+    def _done(self):
+        with self.cond:
+            self.pending -= 1
+            self.cond.notify_all()
+
+    def run(self, tasks, func, *args):
+        """Runs func(task, *args) for the tasks and returns the list of
+        TaskResult in the order of the tasks.
+
+        The exception is raised directly if the tasks run in the calling
+        thread without "keep_going", otherwise it's recorded in the
+        result."""
+        self.aborted.clear()
+        results = [TaskResult(task) for task in tasks]
+
+        scheduled = results
+        if self.cost is not None:
+            scheduled = sorted(
+                results, key=lambda result: self.cost(result.task),
+                reverse=True)
+
+        if self.jobs == 1:
+            for result in scheduled:
+                self._call(result, func, args)
+                delay = self._get_delay(result)
+                while delay is not None:
+                    time.sleep(delay)
+                    self._call(result, func, args)
+                    delay = self._get_delay(result)
+
+                if isinstance(result.exception, KeyboardInterrupt) or (
+                        result.exception is not None and not result.timedout
+                        and not self.keep_going):
+                    raise result.exception
+
+            return results
+
+        self._start()
+        for result in scheduled:
+            self._add((result, func, args, get_base_dir()))
+
+        self.wait()
+
+        return results
+
+    def submit(self, task, func, *args):
+        """Queues func(task, *args) to run by the workers and returns the
+        TaskResult, which is filled once wait() returns."""
+        self._start()
+
+        result = TaskResult(task)
+        self._add((result, func, args, get_base_dir()))
+
+        return result
+
+    def wait(self):
+        """Waits until the queued tasks and their retries are done."""
+        try:
+            with self.cond:
+                while self.pending > 0:
+                    # wake up in time to handle the interruption
+                    self.cond.wait(1)
+        except KeyboardInterrupt:
+            self.aborted.set()
+            raise
+
+        with self.cond:
+            self.timers = [
+                timer for timer in self.timers if timer.is_alive()]
+
+    def is_aborted(self):
+        return self.aborted.is_set()
+
+    def close(self):
+        with self.cond:
+            for timer in self.timers:
+                timer.cancel()
+            self.timers = list()
+
+        for _ in self.workers:
+            self.queue.put(None)
+
+        for worker in self.workers:
+            worker.join()
+
+        self.workers = list()
+
+
+TOPIC_ENTRY = 'WorkerPool, TaskResult'